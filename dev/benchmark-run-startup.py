@@ -0,0 +1,58 @@
+#! /usr/bin/env python3
+
+"""Measure how long Python needs for starting the code that executes runs.
+
+Each generated run script and each Slurm task imports the modules below, so
+their import time is paid once per run or task on the cluster nodes.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO = Path(__file__).resolve().parents[1]
+
+SNIPPETS = [
+    ("bare interpreter", "pass"),
+    (
+        "run script imports",
+        "from lab.calls.call import Call; "
+        "from lab.calls.runtime import configure_logging",
+    ),
+    ("run executor", "import lab.calls.executor"),
+    ("lab.tools", "import lab.tools"),
+    ("lab.experiment", "import lab.experiment"),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--repetitions",
+        type=int,
+        default=20,
+        help="number of interpreter starts per snippet (default: %(default)s)",
+    )
+    return parser.parse_args()
+
+
+def measure(code, repetitions):
+    times = []
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], cwd=REPO, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    args = parse_args()
+    for name, code in SNIPPETS:
+        seconds = measure(code, args.repetitions)
+        print(f"{name:>20}: {seconds * 1000:6.1f} ms")
+
+
+main()
@@ -149,10 +149,12 @@ class FastDownwardExperiment(Experiment):
     #: "planner_wall_clock_time", "score_planner_memory", "score_planner_time".
     PLANNER_PARSER = PlannerParser()
 
-    def __init__(self, path=None, environment=None, revision_cache=None):
+    def __init__(
+        self, path=None, environment=None, revision_cache=None, run_scripts=True
+    ):
         """
         See :class:`lab.experiment.Experiment` for an explanation of
-        the *path* and *environment* parameters.
+        the *path*, *environment* and *run_scripts* parameters.
 
         *revision_cache* is the directory for caching Fast Downward
         revisions. It defaults to ``<scriptdir>/data/revision-cache``.
@@ -176,7 +178,9 @@ class FastDownwardExperiment(Experiment):
         >>> exp.add_parser(exp.PLANNER_PARSER)
 
         """
-        Experiment.__init__(self, path=path, environment=environment)
+        Experiment.__init__(
+            self, path=path, environment=environment, run_scripts=run_scripts
+        )
 
         self.revision_cache = revision_cache or os.path.join(
             get_default_data_dir(), "revision-cache"
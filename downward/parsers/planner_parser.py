@@ -76,6 +76,11 @@ class PlannerParser(Parser):
         self.add_pattern(
             "node", r"node: (.+)\n", type=str, file="driver.log", required=True
         )
+        # CPUs that the run was allowed to use, e.g., "3" for pinned runs.
+        self.add_pattern("cpus", r"cpus: (.+)\n", type=str, file="driver.log")
+        self.add_pattern(
+            "node_speed", r"node speed: (.+)\n", type=float, file="driver.log"
+        )
         self.add_pattern(
             "planner_time",
             r"Planner time: (.+)s",
@@ -88,6 +93,26 @@ class PlannerParser(Parser):
             file="driver.log",
             required=True,
         )
+        # Harness overhead for starting and tearing down the planner process.
+        self.add_pattern(
+            "planner_spawn_time",
+            r"planner spawn time: (.+)s",
+            type=float,
+            file="driver.log",
+        )
+        self.add_pattern(
+            "planner_teardown_time",
+            r"planner teardown time: (.+)s",
+            type=float,
+            file="driver.log",
+        )
+        # Signal that stopped a planner exceeding its wall-clock time limit.
+        self.add_pattern(
+            "planner_watchdog_signal",
+            r"planner watchdog signal: (.+)\n",
+            type=str,
+            file="driver.log",
+        )
 
         self.add_function(add_planner_memory)
         self.add_function(add_planner_time)
@@ -1,12 +1,23 @@
+import contextlib
 import errno
 import logging
+import math
 import os
 import resource
 import select
+import signal
 import subprocess
 import sys
 import time
 
+from lab.calls.runtime import get_fsync_policy
+
+#: Minimum wall-clock time limit in seconds, accounting for disk latencies.
+MIN_WALL_CLOCK_TIME_LIMIT = 30
+#: Seconds between sending SIGTERM and SIGKILL to a command that exceeds
+#: its wall-clock time limit.
+WATCHDOG_GRACE_PERIOD = 5
+
 
 def set_limit(kind, soft_limit, hard_limit):
     try:
@@ -18,6 +29,75 @@ def set_limit(kind, soft_limit, hard_limit):
         )
 
 
+def _find_executable(executable, cwd=None, env=None):
+    """Return the path to *executable* as Popen would resolve it or None."""
+    if os.path.dirname(executable):
+        path = os.path.join(cwd or "", executable)
+        return path if os.access(path, os.X_OK) else None
+    for directory in os.get_exec_path(env):
+        path = os.path.join(directory, executable)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
+
+
+LIMIT_WRAPPER = _find_executable("prlimit")
+
+_PRLIMIT_OPTIONS = {
+    resource.RLIMIT_CPU: "--cpu",
+    resource.RLIMIT_AS: "--as",
+    resource.RLIMIT_CORE: "--core",
+}
+
+
+def _can_set_limit(kind, soft_limit, hard_limit):
+    """Mirror the checks of setrlimit() and log an error if they fail."""
+    _, current_hard_limit = resource.getrlimit(kind)
+
+    def exceeds(limit, bound):
+        if bound == resource.RLIM_INFINITY:
+            return False
+        return limit == resource.RLIM_INFINITY or limit > bound
+
+    if exceeds(soft_limit, hard_limit) or (
+        os.geteuid() != 0 and exceeds(hard_limit, current_hard_limit)
+    ):
+        logging.error(
+            f"Resource limit for {kind} could not be set to "
+            f"[{soft_limit}, {hard_limit}] (current hard limit: "
+            f"{current_hard_limit})"
+        )
+        return False
+    return True
+
+
+def get_limit_wrapper_args(limits):
+    """Return a prlimit command prefix that sets the given resource limits.
+
+    *limits* is a list of (kind, soft_limit, hard_limit) tuples. Limits
+    that cannot be set are skipped after logging an error, just like
+    set_limit() does.
+
+    """
+
+    def format_limit(limit):
+        return "unlimited" if limit == resource.RLIM_INFINITY else str(int(limit))
+
+    args = [LIMIT_WRAPPER]
+    for kind, soft_limit, hard_limit in limits:
+        if _can_set_limit(kind, soft_limit, hard_limit):
+            args.append(
+                f"{_PRLIMIT_OPTIONS[kind]}="
+                f"{format_limit(soft_limit)}:{format_limit(hard_limit)}"
+            )
+    args.append("--")
+    return args
+
+
+def _get_seconds(nanoseconds):
+    return nanoseconds / 1e9
+
+
 class Call:
     def __init__(
         self,
@@ -47,7 +127,12 @@ class Call:
             self.wall_clock_time_limit = None
         else:
             # Enforce miminum on wall-clock limit to account for disk latencies.
-            self.wall_clock_time_limit = max(30, time_limit * 1.5)
+            self.wall_clock_time_limit = max(
+                MIN_WALL_CLOCK_TIME_LIMIT, time_limit * 1.5
+            )
+            # Start the command in a new process group, so that the watchdog
+            # can stop the command and all of its children.
+            kwargs.setdefault("start_new_session", True)
 
         def get_bytes(limit):
             return None if limit is None else int(limit * 1024)
@@ -75,27 +160,105 @@ class Call:
                 )
                 kwargs[stream_name] = subprocess.PIPE
 
+        limits = []
+        # When the soft time limit is reached, SIGXCPU is emitted. Once we
+        # reach the higher hard time limit, SIGKILL is sent. Having some
+        # padding between the two limits allows programs to handle SIGXCPU.
+        if time_limit is not None:
+            limits.append((resource.RLIMIT_CPU, time_limit, time_limit + 5))
+        if memory_limit is not None:
+            _, hard_mem_limit = resource.getrlimit(resource.RLIMIT_AS)
+            # Convert memory from MiB to Bytes.
+            limits.append(
+                (resource.RLIMIT_AS, memory_limit * 1024 * 1024, hard_mem_limit)
+            )
+        limits.append((resource.RLIMIT_CORE, 0, 0))
+
         def prepare_call():
-            # When the soft time limit is reached, SIGXCPU is emitted. Once we
-            # reach the higher hard time limit, SIGKILL is sent. Having some
-            # padding between the two limits allows programs to handle SIGXCPU.
-            if time_limit is not None:
-                set_limit(resource.RLIMIT_CPU, time_limit, time_limit + 5)
-            if memory_limit is not None:
-                _, hard_mem_limit = resource.getrlimit(resource.RLIMIT_AS)
-                # Convert memory from MiB to Bytes.
-                set_limit(
-                    resource.RLIMIT_AS, memory_limit * 1024 * 1024, hard_mem_limit
-                )
-            set_limit(resource.RLIMIT_CORE, 0, 0)
+            for kind, soft_limit, hard_limit in limits:
+                set_limit(kind, soft_limit, hard_limit)
+
+        # Passing a preexec_fn forces CPython to use the slow fork+exec path,
+        # which copies the page tables of the parent and is unsafe in the
+        # presence of threads. If possible, we therefore let the tiny prlimit
+        # tool set the limits and exec the command. This allows CPython to
+        # spawn the process with vfork() or posix_spawn().
+        use_limit_wrapper = (
+            LIMIT_WRAPPER is not None
+            and isinstance(args, (list, tuple))
+            and not kwargs.get("shell")
+            and "executable" not in kwargs
+        )
+        if use_limit_wrapper:
+            if not _find_executable(args[0], kwargs.get("cwd"), kwargs.get("env")):
+                sys.exit(f'Error: Call {name} failed. "{args[0]}" not found.')
+            popen_args = get_limit_wrapper_args(limits) + list(args)
+            popen_kwargs = kwargs
+        else:
+            popen_args = args
+            popen_kwargs = dict(kwargs, preexec_fn=prepare_call)
 
+        # Use a monotonic clock, because the wall-clock time may jump
+        # (e.g., when NTP adjusts the system time on cluster nodes).
+        self._start_ns = time.perf_counter_ns()
         try:
-            self.process = subprocess.Popen(args, preexec_fn=prepare_call, **kwargs)
+            self.process = subprocess.Popen(popen_args, **popen_kwargs)
         except OSError as err:
             if err.errno == errno.ENOENT:
                 sys.exit(f'Error: Call {name} failed. "{args[0]}" not found.')
             else:
                 raise
+        self._spawned_ns = time.perf_counter_ns()
+        self._watchdog_deadline_ns = None
+        self._own_process_group = bool(kwargs.get("start_new_session"))
+        if self.wall_clock_time_limit is not None and self._own_process_group:
+            self._watchdog_deadline_ns = self._start_ns + int(
+                self.wall_clock_time_limit * 1e9
+            )
+
+        #: Name of the last signal that the watchdog sent to the process
+        #: group of the command (None if the command stayed in its limit).
+        self.watchdog_signal = None
+        #: Seconds needed for starting the process.
+        self.spawn_time = _get_seconds(self._spawned_ns - self._start_ns)
+        #: Seconds between starting the process and reaping it (set by wait()).
+        self.wall_clock_time = None
+        #: Seconds needed for flushing and closing the output files after
+        #: the process has been reaped (set by wait()).
+        self.teardown_time = None
+
+    def _signal_process_group(self, sig):
+        # The group exists as long as the unreaped process exists.
+        with contextlib.suppress(ProcessLookupError, PermissionError):
+            os.killpg(self.process.pid, sig)
+
+    def _run_watchdog(self):
+        """Stop the command if it exceeds its wall-clock time limit.
+
+        First send SIGTERM to the process group of the command and, if it
+        is still running after :data:`WATCHDOG_GRACE_PERIOD` seconds,
+        SIGKILL. Return the seconds until the next check is due or None if
+        there is nothing left to check.
+
+        """
+        if self._watchdog_deadline_ns is None:
+            return None
+        now = time.perf_counter_ns()
+        if now < self._watchdog_deadline_ns:
+            return _get_seconds(self._watchdog_deadline_ns - now)
+        if self.watchdog_signal is None:
+            sig = signal.SIGTERM
+            self._watchdog_deadline_ns = now + int(WATCHDOG_GRACE_PERIOD * 1e9)
+        else:
+            sig = signal.SIGKILL
+            self._watchdog_deadline_ns = None
+        logging.error(
+            f"{self.name} exceeded the wall-clock time limit of "
+            f"{self.wall_clock_time_limit}s -> send {sig.name} to its processes"
+        )
+        self.watchdog_signal = sig.name
+        self._signal_process_group(sig)
+        return self._run_watchdog()
 
     def _redirect_streams(self):
         """
@@ -139,8 +302,11 @@ class Call:
             fd_to_limits[fd] = limits
 
         while fd_to_infile:
+            timeout = self._run_watchdog()
             try:
-                ready = poller.poll()
+                ready = poller.poll(
+                    None if timeout is None else math.ceil(timeout * 1000)
+                )
             except OSError as e:
                 if e.args[0] == errno.EINTR:
                     continue
@@ -186,27 +352,47 @@ class Call:
                         f"(soft limit: {soft_limit / 1024:.2f} KiB)"
                     )
 
-    def wait(self):
-        wall_clock_start_time = time.time()
+    def _wait_for_process(self):
         self._redirect_streams()
-        retcode = self.process.wait()
+        while True:
+            try:
+                return self.process.wait(timeout=self._run_watchdog())
+            except subprocess.TimeoutExpired:
+                pass
+
+    def wait(self):
+        try:
+            retcode = self._wait_for_process()
+        except BaseException:
+            # Don't leave the command running if we are interrupted.
+            if self._own_process_group and self.process.poll() is None:
+                self._signal_process_group(signal.SIGKILL)
+            raise
+        reaped_ns = time.perf_counter_ns()
+        sync = get_fsync_policy() == "always"
         for stream, _ in self.redirected_streams_and_limits.values():
-            # Write output to disk before the next Call starts.
             stream.flush()
-            os.fsync(stream.fileno())
+            if sync:
+                # Write output to disk before the next Call starts.
+                os.fsync(stream.fileno())
 
         # Close files that were opened in the constructor.
         for file in self.opened_files:
             file.close()
-        wall_clock_time = time.time() - wall_clock_start_time
-        logging.info(f"{self.name} wall-clock time: {wall_clock_time:.2f}s")
+        self.wall_clock_time = _get_seconds(reaped_ns - self._start_ns)
+        self.teardown_time = _get_seconds(time.perf_counter_ns() - reaped_ns)
+        logging.info(f"{self.name} wall-clock time: {self.wall_clock_time:.2f}s")
+        logging.info(f"{self.name} spawn time: {self.spawn_time:.6f}s")
+        logging.info(f"{self.name} teardown time: {self.teardown_time:.6f}s")
         if (
             self.wall_clock_time_limit is not None
-            and wall_clock_time > self.wall_clock_time_limit
+            and self.wall_clock_time > self.wall_clock_time_limit
         ):
             logging.error(
                 f"wall-clock time for {self.name} too high: "
-                f"{wall_clock_time:.2f} > {self.wall_clock_time_limit}"
+                f"{self.wall_clock_time:.2f} > {self.wall_clock_time_limit}"
             )
+        if self.watchdog_signal is not None:
+            logging.info(f"{self.name} watchdog signal: {self.watchdog_signal}")
         logging.info(f"{self.name} exit code: {retcode}")
         return retcode
@@ -0,0 +1,640 @@
+"""Execute runs directly from their run specifications.
+
+The generated ``run`` script of each run starts a new Python interpreter,
+which costs a lot of time for experiments with many short runs. This
+module executes the commands of a run in the calling process instead, so
+that long-lived workers can execute many runs back-to-back. The ``run``
+scripts are only used as a fallback, e.g., for runs whose commands cannot
+be serialized to JSON.
+
+"""
+
+import argparse
+import contextlib
+import fcntl
+import functools
+import json
+import logging
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+from array import array
+
+from lab.calls.call import Call
+from lab.calls.runtime import (
+    calibrate_node,
+    configure_logging,
+    get_fsync_policy,
+    get_python_executable,
+    log_run_info,
+    sync_after_run,
+    sync_after_task,
+)
+
+#: Name of the experiment-level file that stores one JSON-encoded run
+#: specification per line. Line *i* holds the specification of run *i*.
+RUN_SPECS_FILENAME = "run-specs.jsonl"
+#: Name of the file that stores the byte offsets of the run specifications.
+RUN_SPECS_INDEX_FILENAME = "run-specs.index"
+#: Name of the experiment-level journal of started and finished runs.
+RUN_JOURNAL_FILENAME = "run-journal.jsonl"
+#: Prefix of the experiment-level files that hand out runs to Slurm tasks.
+RUN_QUEUE_PREFIX = "run-queue-"
+#: Files that the executor writes into a run directory.
+RUN_LOG_FILES = ["driver.log", "driver.err", "run.log", "run.err"]
+
+
+def get_run_spec(run_dir, calls, properties=None, cores=1, memory=None):
+    """Return the specification for a run with the given *calls*.
+
+    *calls* is a list of (args, kwargs) pairs for :class:`Call
+    <lab.calls.call.Call>`. If the calls can't be encoded as JSON, the
+    "calls" entry of the specification is None. If *properties* is given,
+    store them in the specification instead of a "static-properties" file.
+    *cores* and *memory* (in MiB) are the resources that the run needs.
+
+    """
+    spec = {"run_dir": run_dir, "calls": None, "cores": cores, "memory": memory}
+    if properties is not None:
+        spec["properties"] = properties
+    calls = [{"args": args, "kwargs": kwargs} for args, kwargs in calls]
+    # Make sure that the calls survive a round-trip through JSON.
+    with contextlib.suppress(TypeError, ValueError):
+        spec["calls"] = json.loads(json.dumps(calls))
+    return spec
+
+
+class RunSpecsWriter:
+    """Write run specifications and their index to the experiment dir."""
+
+    def __init__(self, exp_path):
+        self.specs_file = open(os.path.join(exp_path, RUN_SPECS_FILENAME), "wb")
+        self.index_path = os.path.join(exp_path, RUN_SPECS_INDEX_FILENAME)
+        self.offsets = array("Q")
+
+    def add(self, spec):
+        self.offsets.append(self.specs_file.tell())
+        self.specs_file.write(json.dumps(spec).encode() + b"\n")
+
+    def close(self):
+        self.specs_file.close()
+        with open(self.index_path, "wb") as f:
+            self.offsets.tofile(f)
+
+
+class RunSpecs:
+    """Provide random access to the run specifications of an experiment.
+
+    Experiments built without run specifications have no specs.
+
+    """
+
+    def __init__(self, exp_path):
+        self.path = os.path.join(exp_path, RUN_SPECS_FILENAME)
+        self.offsets = array("Q")
+        index_path = os.path.join(exp_path, RUN_SPECS_INDEX_FILENAME)
+        if os.path.exists(index_path):
+            with open(index_path, "rb") as f:
+                self.offsets.frombytes(f.read())
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        if self.offsets:
+            with open(self.path, "rb") as f:
+                for line in f:
+                    yield json.loads(line)
+
+    def get(self, run_id):
+        """Return the specification of run *run_id* or None if it's missing."""
+        if not 1 <= run_id <= len(self.offsets):
+            return None
+        # Open the file for each lookup. This is cheap compared to
+        # executing a run and safe for forked worker processes.
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[run_id - 1])
+            return json.loads(f.readline())
+
+
+class RunJournal:
+    """Append-only journal of the state transitions of runs.
+
+    Each line is a JSON object with the keys "run" (the run ID), "state"
+    ("started", "finished" or "reset") and "time". Entries for finished
+    runs also have an "error" key. Each entry is appended with a single
+    write to a locked file opened in append mode, so concurrent worker
+    processes and Slurm tasks on different nodes can add entries. Unless
+    the fsync policy is "task" or "never", each entry is synced to disk,
+    so a crash loses at most the last entry.
+
+    """
+
+    def __init__(self, exp_path):
+        self.path = os.path.join(exp_path, RUN_JOURNAL_FILENAME)
+
+    def add(self, run_id, state, **info):
+        entry = {"run": run_id, "state": state, "time": time.time(), **info}
+        line = json.dumps(entry).encode() + b"\n"
+        fd = os.open(self.path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            size = os.fstat(fd).st_size
+            if size and os.pread(fd, 1, size - 1) != b"\n":
+                # Start a new line after an entry that a crash cut short.
+                line = b"\n" + line
+            os.write(fd, line)
+            if get_fsync_policy() in ["always", "run"]:
+                os.fsync(fd)
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+    def get_entries(self):
+        """Return the list of all journal entries in the order of writing.
+
+        Reading doesn't modify the journal, since Slurm tasks may still
+        append entries.
+
+        """
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        for line in lines:
+            if not line.endswith(b"\n"):
+                # Skip an entry that is still being written.
+                continue
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                # Ignore an entry that a crash cut short.
+                continue
+        return entries
+
+    def get_states(self):
+        """Return a dict that maps run IDs to their last journal entry."""
+        return {entry["run"]: entry for entry in self.get_entries()}
+
+
+def get_run_order(num_runs, seed):
+    """Return the run IDs in the order given by *seed* (0: ascending order).
+
+    >>> get_run_order(4, 0)
+    [1, 2, 3, 4]
+    >>> sorted(get_run_order(4, 42))
+    [1, 2, 3, 4]
+
+    """
+    run_ids = list(range(1, num_runs + 1))
+    if seed:
+        random.Random(seed).shuffle(run_ids)
+    return run_ids
+
+
+class RunQueue:
+    """Hand out runs to concurrent executors, e.g., the tasks of a Slurm array.
+
+    The queue file stores the number of runs that have been handed out.
+    Executors lock the file before reading and incrementing the number, so
+    each run is claimed exactly once, even on shared filesystems. Each
+    queue is identified by the *seed* of its run order, which must be new
+    for each submission. If *shuffle* is False, the runs are claimed in
+    ascending order.
+
+    """
+
+    def __init__(self, exp_path, num_runs, seed, shuffle=True):
+        self.path = os.path.join(exp_path, f"{RUN_QUEUE_PREFIX}{seed}")
+        self.run_ids = get_run_order(num_runs, seed if shuffle else 0)
+
+    def claim(self):
+        """Return the ID of the next unclaimed run or None if there is none."""
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            index = int(os.pread(fd, 32, 0) or 0)
+            if index >= len(self.run_ids):
+                return None
+            # The number never gets shorter, so we can overwrite it.
+            os.pwrite(fd, str(index + 1).encode(), 0)
+            os.fsync(fd)
+            return self.run_ids[index]
+        finally:
+            # Closing the file releases the lock.
+            os.close(fd)
+
+
+def reset_run(run_dir):
+    """Remove the log files of an interrupted run, so that it can be rerun."""
+    for filename in RUN_LOG_FILES:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(os.path.join(run_dir, filename))
+
+
+def reset_unfinished_runs(exp_path, num_runs, include_failed=False):
+    """Prepare the runs that have to be executed again and return their IDs.
+
+    This concerns runs that never finished according to the journal, e.g.,
+    because their Slurm task failed or was preempted, and finished runs
+    whose directory is missing. If *include_failed* is True, failed runs
+    are executed again as well. Remove the log files of these runs and
+    mark them as "reset" in the journal, so that they are executed again.
+
+    """
+    journal = RunJournal(exp_path)
+    states = journal.get_states()
+    from lab.calls import shards
+
+    run_shards = shards.get_run_shards(exp_path)
+    run_specs = RunSpecs(exp_path)
+    run_ids = []
+    for run_id in range(1, num_runs + 1):
+        rel_run_dir, _ = _get_run(run_specs, run_id)
+        run_dir = os.path.join(exp_path, rel_run_dir)
+        entry = states.get(run_id, {})
+        finished = entry.get("state") == "finished" and (
+            rel_run_dir in run_shards
+            or os.path.exists(os.path.join(run_dir, "driver.log"))
+        )
+        if finished and not (include_failed and entry.get("error")):
+            continue
+        reset_run(run_dir)
+        journal.add(run_id, "reset")
+        run_ids.append(run_id)
+    return run_ids
+
+
+def _execute_calls(calls):
+    """Execute *calls* in the current directory like the ``run`` script."""
+    log_run_info()
+
+    run_log = open("run.log", "wb")
+    run_err = open("run.err", "wb", buffering=0)  # disable buffering
+    redirects = {"stdout": run_log, "stderr": run_err}
+
+    try:
+        for call in calls:
+            Call(call["args"], **call["kwargs"], **redirects).wait()
+    finally:
+        # Failed calls abort with sys.exit(), but we still sync their output.
+        sync_after_run([run_log, run_err])
+        for f in [run_log, run_err]:
+            f.close()
+            if os.path.getsize(f.name) == 0:
+                os.remove(f.name)
+
+
+def execute_run(run_dir, calls, driver_log, driver_err):
+    """Execute *calls* in *run_dir* without starting a new interpreter.
+
+    Log messages are written to the file objects *driver_log* and
+    *driver_err*, exactly like the output of the ``run`` script. Return
+    True iff the run failed.
+
+    """
+    old_cwd = os.getcwd()
+    error = False
+    redirect_stdout = contextlib.redirect_stdout(driver_log)
+    redirect_stderr = contextlib.redirect_stderr(driver_err)
+    try:
+        with redirect_stdout, redirect_stderr:
+            configure_logging()
+            try:
+                os.chdir(run_dir)
+                _execute_calls(calls)
+            except SystemExit as err:
+                # Call and critical log messages abort with sys.exit().
+                if err.code not in [None, 0]:
+                    error = True
+                    if not isinstance(err.code, int):
+                        print(err.code, file=sys.stderr)
+            except Exception:
+                error = True
+                traceback.print_exc()
+            finally:
+                os.chdir(old_cwd)
+    finally:
+        # Send log messages to the real stdout and stderr again, also if
+        # the task is terminated.
+        configure_logging()
+    return error
+
+
+def process_run(run_dir, spec=None):
+    """Execute the run in *run_dir* unless it has already been started.
+
+    If the run specification *spec* contains the calls of the run, execute
+    the run in this process. Otherwise, fall back to executing the ``run``
+    script in a new Python interpreter. Return True iff the run failed.
+
+    """
+    error = False
+    # Runs without files of their own only get a directory when they start.
+    os.makedirs(run_dir, exist_ok=True)
+    driver_log_file = os.path.join(run_dir, "driver.log")
+
+    if os.path.exists(driver_log_file):
+        logging.info(f"The run in {run_dir} has already been started --> skip it")
+        return False
+
+    driver_err_file = os.path.join(run_dir, "driver.err")
+    with open(driver_log_file, "w") as driver_log, open(
+        driver_err_file, "w"
+    ) as driver_err:
+        if spec is None or spec["calls"] is None:
+            try:
+                subprocess.check_call(
+                    [get_python_executable(), "run"],
+                    cwd=run_dir,
+                    stdout=driver_log,
+                    stderr=driver_err,
+                )
+            except subprocess.CalledProcessError as err:
+                error = True
+                print(
+                    f"The run script finished with exit code {err.returncode}",
+                    file=driver_err,
+                )
+        else:
+            error = execute_run(run_dir, spec["calls"], driver_log, driver_err)
+
+    # driver.log always has content for a successful run, so we never delete it.
+    if os.path.getsize(driver_err_file) == 0:
+        os.remove(driver_err_file)
+    else:
+        error = True
+
+    return error
+
+
+def _copy_run_dir(src_exp_path, rel_run_dir, dest_exp_path, relative_links):
+    """Copy a run dir and adapt its links to files outside of the experiment.
+
+    Resources added with ``symlink=True`` are linked relative to the run
+    dir, so links to files outside of the experiment dir (e.g.,
+    benchmarks) break when the run dir moves. Make these links absolute
+    or, if *relative_links* is True, relative to their new location.
+
+    """
+    src_exp_path = os.path.abspath(src_exp_path)
+    src = os.path.join(src_exp_path, rel_run_dir)
+    dest = os.path.join(dest_exp_path, rel_run_dir)
+    shutil.copytree(src, dest, symlinks=True)
+    for root, dirs, files in os.walk(dest):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            if not os.path.islink(path):
+                continue
+            src_dir = os.path.join(src, os.path.relpath(root, dest))
+            target = os.path.normpath(os.path.join(src_dir, os.readlink(path)))
+            if os.path.commonpath([target, src_exp_path]) == src_exp_path:
+                # Links within the experiment dir work in both places.
+                continue
+            if relative_links:
+                target = os.path.relpath(target, root)
+            os.remove(path)
+            os.symlink(target, path)
+
+
+def stage_in_run(exp_path, scratch_exp_path, rel_run_dir):
+    """Copy a run dir of the experiment to the scratch experiment dir."""
+    # Runs without files of their own have no directory yet.
+    if os.path.exists(os.path.join(exp_path, rel_run_dir)):
+        _copy_run_dir(exp_path, rel_run_dir, scratch_exp_path, relative_links=False)
+
+
+def stage_in(exp_path, rel_run_dirs, scratch_dir):
+    """Copy the given run dirs of an experiment to *scratch_dir*.
+
+    Return the path of a new directory below *scratch_dir* that mirrors
+    the experiment directory: the run dirs are copies and all other
+    entries of the experiment directory are symbolic links to the
+    originals. This keeps the relative links from run dirs to experiment
+    resources (e.g., the code of the solvers) intact. Relative links to
+    files outside of the experiment directory are made absolute.
+
+    """
+    os.makedirs(scratch_dir, exist_ok=True)
+    scratch_exp_path = tempfile.mkdtemp(prefix="lab-", dir=scratch_dir)
+    abs_exp_path = os.path.abspath(exp_path)
+    for name in os.listdir(abs_exp_path):
+        if not name.startswith("runs-"):
+            os.symlink(
+                os.path.join(abs_exp_path, name), os.path.join(scratch_exp_path, name)
+            )
+    for rel_run_dir in rel_run_dirs:
+        stage_in_run(exp_path, scratch_exp_path, rel_run_dir)
+    logging.info(f"Staged {len(rel_run_dirs)} runs in to {scratch_exp_path}")
+    return scratch_exp_path
+
+
+def stage_out(scratch_exp_path, rel_run_dirs, exp_path):
+    """Copy the run dirs back to the experiment and remove the scratch dir.
+
+    Links to files outside of the experiment dir become relative again.
+
+    """
+    for rel_run_dir in rel_run_dirs:
+        src = os.path.join(scratch_exp_path, rel_run_dir)
+        dest = os.path.join(exp_path, rel_run_dir)
+        if os.path.exists(src):
+            # The staged run dir contains everything of the original one.
+            if os.path.exists(dest):
+                shutil.rmtree(dest)
+            _copy_run_dir(scratch_exp_path, rel_run_dir, exp_path, relative_links=True)
+    shutil.rmtree(scratch_exp_path)
+    logging.info(f"Staged {len(rel_run_dirs)} runs out to {exp_path}")
+
+
+def remove_run_dirs(exp_path, rel_run_dirs):
+    """Remove the run dirs and the then empty parent dirs."""
+    for rel_run_dir in rel_run_dirs:
+        run_dir = os.path.join(exp_path, rel_run_dir)
+        if os.path.exists(run_dir):
+            shutil.rmtree(run_dir)
+        with contextlib.suppress(OSError):
+            os.rmdir(os.path.dirname(run_dir))
+
+
+def _get_run(run_specs, run_id):
+    """Return the relative run dir and the specification of a run."""
+    spec = run_specs.get(run_id)
+    if spec is None:
+        # Experiments built without run specifications.
+        from lab.experiment import get_run_dir
+
+        return get_run_dir(run_id), None
+    return spec["run_dir"], spec
+
+
+@functools.lru_cache(maxsize=None)
+def _get_run_specs(exp_path):
+    return RunSpecs(exp_path)
+
+
+def _process_run_id(exp_path, journal, run_id):
+    rel_run_dir, spec = _get_run(_get_run_specs(exp_path), run_id)
+    logging.info(f"Starting run {run_id} in {rel_run_dir}")
+    journal.add(run_id, "started")
+    error = process_run(os.path.join(exp_path, rel_run_dir), spec)
+    journal.add(run_id, "finished", error=error)
+    return error
+
+
+class TaskTerminated(BaseException):
+    """Raised when Slurm stops the task.
+
+    Unlike :py:class:`SystemExit`, which signals a failed call, this
+    exception stops the whole task. The interrupted run is not marked as
+    finished in the journal, so it is executed again on resubmission.
+
+    """
+
+
+def _terminate(signum, _frame):
+    # Finish staging out even if the signal is sent again.
+    signal.signal(signum, signal.SIG_IGN)
+    raise TaskTerminated(f"Received signal {signum} --> stop executing runs")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Execute runs of an experiment.")
+    parser.add_argument("exp_path", help="experiment directory")
+    parser.add_argument("run_ids", nargs="*", type=int, help="runs to execute")
+    parser.add_argument(
+        "--pull",
+        type=int,
+        metavar="SEED",
+        help="instead of executing the given runs, claim runs from the queue "
+        "with the given run order seed until all runs have been claimed",
+    )
+    parser.add_argument(
+        "--ordered",
+        action="store_true",
+        help="claim the runs from the queue in ascending order",
+    )
+    parser.add_argument(
+        "--pack",
+        action="store_true",
+        help="pack the run dirs into a shard of the experiment and remove them",
+    )
+    parser.add_argument(
+        "--scratch",
+        help="execute the runs in a new directory below this node-local "
+        "directory and copy them back to the experiment at the end",
+    )
+    parser.add_argument(
+        "--calibrate",
+        action="store_true",
+        help="measure the speed of the node before executing the runs",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="number of cores for executing runs concurrently (default: 1)",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        help="memory in MiB for runs that are executed concurrently "
+        "(default: physical memory)",
+    )
+    args = parser.parse_args()
+    if args.pull is not None and args.processes > 1:
+        parser.error("--pull can't be combined with --processes")
+    return args
+
+
+def main():
+    """Execute the given runs of an experiment in this process or a pool."""
+    args = parse_args()
+    configure_logging()
+    if args.calibrate:
+        calibrate_node()
+    run_specs = RunSpecs(args.exp_path)
+    if args.pull is None:
+        run_ids = args.run_ids
+    else:
+        queue = RunQueue(
+            args.exp_path, len(run_specs), args.pull, shuffle=not args.ordered
+        )
+        run_ids = iter(queue.claim, None)
+
+    # The journal of the experiment records which runs finished.
+    journal = RunJournal(args.exp_path)
+    exp_path = args.exp_path
+    if args.scratch:
+        exp_path = stage_in(args.exp_path, [], args.scratch)
+        # Stage out the finished runs when Slurm stops the task.
+        signal.signal(signal.SIGTERM, _terminate)
+    rel_run_dirs = []
+    try:
+        if args.processes == 1:
+            for run_id in run_ids:
+                rel_run_dir, _ = _get_run(run_specs, run_id)
+                rel_run_dirs.append(rel_run_dir)
+                if args.scratch:
+                    stage_in_run(args.exp_path, exp_path, rel_run_dir)
+                _process_run_id(exp_path, journal, run_id)
+        else:
+            from lab.calls import scheduler
+
+            tasks = []
+            for run_id in run_ids:
+                rel_run_dir, spec = _get_run(run_specs, run_id)
+                rel_run_dirs.append(rel_run_dir)
+                if args.scratch:
+                    stage_in_run(args.exp_path, exp_path, rel_run_dir)
+                spec = spec or {}
+                tasks.append(
+                    scheduler.Task(
+                        run_id, cores=spec.get("cores", 1), memory=spec.get("memory")
+                    )
+                )
+            # Execute multiple runs at once, but don't exceed the cores and
+            # memory of the Slurm task.
+            scheduler.run_tasks(
+                functools.partial(_process_run_id, exp_path, journal),
+                tasks,
+                processes=args.processes,
+                memory_budget=args.memory_budget,
+            )
+    except BaseException as err:
+        # Keep the run dirs of interrupted tasks unpacked.
+        if args.scratch:
+            stage_out(exp_path, rel_run_dirs, args.exp_path)
+        if isinstance(err, TaskTerminated):
+            sys.exit(f"Error: {err}")
+        raise
+    if args.pack:
+        # Only import the tarfile module if runs are packed.
+        from lab.calls import shards
+
+        shard_path = shards.pack_runs(
+            exp_path,
+            rel_run_dirs,
+            os.path.join(args.exp_path, shards.SHARDS_DIRNAME),
+        )
+        logging.info(f"Packed {len(rel_run_dirs)} runs into {shard_path}")
+        remove_run_dirs(args.exp_path, rel_run_dirs)
+        if args.scratch:
+            shutil.rmtree(exp_path)
+    elif args.scratch:
+        stage_out(exp_path, rel_run_dirs, args.exp_path)
+    # Packed run dirs are gone, but pack_runs() syncs the shard itself.
+    sync_after_task(
+        [os.path.join(args.exp_path, rel_run_dir) for rel_run_dir in rel_run_dirs]
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Import-light helpers for run scripts and run executors.
+
+Each run imports this module, so it must only import modules that Python
+loads quickly. Put everything else into :mod:`lab.tools`.
+
+"""
+
+import getpass
+import logging
+import os
+import platform
+import sys
+import time
+
+#: Environment variable that selects when run outputs are synced to disk.
+FSYNC_VARIABLE = "LAB_FSYNC"
+#: Sync the outputs of each command ("always"), of each run ("run"), the
+#: files of all runs once at the end of a task ("task") or leave it to the
+#: OS ("never").
+FSYNC_POLICIES = ["always", "run", "task", "never"]
+
+
+def get_fsync_policy():
+    policy = os.environ.get(FSYNC_VARIABLE, "always")
+    if policy not in FSYNC_POLICIES:
+        sys.exit(f"Error: {FSYNC_VARIABLE} must be one of {FSYNC_POLICIES}.")
+    return policy
+
+
+def sync_after_run(files):
+    """Sync the output *files* of a run if the fsync policy asks for it."""
+    if get_fsync_policy() == "run":
+        for f in files:
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_after_task(run_dirs):
+    """Sync the files in *run_dirs* if the fsync policy asks for it.
+
+    Unlike :py:func:`os.sync`, this leaves the files of other users of a
+    shared node alone.
+
+    """
+    if get_fsync_policy() != "task":
+        return
+    for run_dir in run_dirs:
+        for root, _, filenames in os.walk(run_dir):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if not os.path.islink(path):
+                    _fsync_path(path)
+            # Persist the directory entries of new files, too.
+            _fsync_path(root)
+
+
+#: Environment variable that passes the speed of the node to the runs.
+NODE_SPEED_VARIABLE = "LAB_NODE_SPEED"
+#: Number of loop iterations of the calibration benchmark.
+BENCHMARK_ITERATIONS = 300000
+#: CPU time in seconds that the benchmark takes on the reference machine.
+REFERENCE_BENCHMARK_TIME = 0.1
+
+
+def _run_benchmark():
+    # Mix integer arithmetic with dictionary accesses, like a search does.
+    total = 0
+    table = {}
+    for i in range(BENCHMARK_ITERATIONS):
+        total = (total * 31 + i) % 1000003
+        table[total & 1023] = table.get(i & 1023, 0) + 1
+    return total
+
+
+def measure_node_speed(repetitions=3):
+    """Return how many times faster this node runs a fixed benchmark.
+
+    The speed is relative to the reference machine. We use the fastest of
+    *repetitions* measurements to reduce the noise caused by other
+    processes.
+
+    """
+    times = []
+    for _ in range(repetitions):
+        start = time.process_time()
+        _run_benchmark()
+        times.append(time.process_time() - start)
+    return REFERENCE_BENCHMARK_TIME / max(min(times), 1e-6)
+
+
+def calibrate_node():
+    """Measure the node speed once and pass it to all runs of the task."""
+    if NODE_SPEED_VARIABLE not in os.environ:
+        speed = measure_node_speed()
+        logging.info(f"Calibrated node speed: {speed:.4f}")
+        os.environ[NODE_SPEED_VARIABLE] = f"{speed:.4f}"
+
+
+def log_node_speed():
+    """Log the node speed for the parsers if the node has been calibrated."""
+    speed = os.environ.get(NODE_SPEED_VARIABLE)
+    if speed:
+        logging.info(f"node speed: {speed}")
+
+
+def get_python_executable():
+    return sys.executable or "python"
+
+
+def format_cpu_list(cpus):
+    """Return the CPU ids *cpus* in the compact notation of the kernel.
+
+    >>> format_cpu_list({0, 1, 2, 3, 8, 10, 11})
+    '0-3,8,10-11'
+
+    """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and ranges[-1][1] == cpu - 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+def get_cpu_affinity():
+    """Return the CPUs this process may run on or None if that's unknown."""
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    return format_cpu_list(os.sched_getaffinity(0))
+
+
+def log_run_info():
+    """Log where and as whom the current run is executed."""
+    logging.info(f"node: {platform.node()}")
+    logging.info(f"username: {getpass.getuser()}")
+    cpus = get_cpu_affinity()
+    if cpus:
+        logging.info(f"cpus: {cpus}")
+    log_node_speed()
+
+    for slurm_key in ["SLURM_ARRAY_JOB_ID", "SLURM_ARRAY_TASK_ID"]:
+        if slurm_key in os.environ:
+            logging.info(f"{slurm_key}: {os.environ.get(slurm_key)}")
+
+
+def configure_logging(level=logging.INFO):
+    # Python adds a default handler if some log is written before this
+    # function is called. We therefore remove all handlers that have
+    # been added automatically.
+    root_logger = logging.getLogger("")
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+
+    class ErrorAbortHandler(logging.StreamHandler):
+        """
+        Logging handler that exits when a critical error is encountered.
+        """
+
+        def emit(self, record):
+            logging.StreamHandler.emit(self, record)
+            if record.levelno >= logging.CRITICAL:
+                sys.exit("aborting")
+
+    class StdoutFilter(logging.Filter):
+        def filter(self, record):
+            return record.levelno <= logging.WARNING
+
+    class StderrFilter(logging.Filter):
+        def filter(self, record):
+            return record.levelno > logging.WARNING
+
+    formatter = logging.Formatter("%(asctime)-s %(levelname)-8s %(message)s")
+
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(formatter)
+    stdout_handler.addFilter(StdoutFilter())
+
+    stderr_handler = ErrorAbortHandler(sys.stderr)
+    stderr_handler.setFormatter(formatter)
+    stderr_handler.addFilter(StderrFilter())
+
+    root_logger.addHandler(stdout_handler)
+    root_logger.addHandler(stderr_handler)
+    root_logger.setLevel(level)
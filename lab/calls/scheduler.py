@@ -0,0 +1,365 @@
+"""Execute tasks in parallel without exceeding a core and memory budget."""
+
+import contextlib
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import defaultdict, deque, namedtuple
+
+#: A task that needs *cores* cores and *memory* MiB (None if unknown).
+Task = namedtuple("Task", ["task_id", "cores", "memory"])
+
+
+#: Seconds between two progress lines in the log.
+PROGRESS_INTERVAL = 30
+#: Minimum number of seconds between two updates of the progress file.
+PROGRESS_FILE_INTERVAL = 1
+
+SYSFS_CPU_DIR = "/sys/devices/system/cpu"
+
+
+def get_total_memory():
+    """Return the physical memory of this machine in MiB."""
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 1024**2
+
+
+def parse_cpu_list(text):
+    """Parse a CPU list in the compact notation of the kernel.
+
+    >>> parse_cpu_list("0-3,8,10-11")
+    [0, 1, 2, 3, 8, 10, 11]
+
+    """
+    cpus = []
+    for part in text.strip().split(","):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _read_cpu_file(cpu, *parts):
+    path = os.path.join(SYSFS_CPU_DIR, f"cpu{cpu}", *parts)
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _get_numa_node(cpu):
+    cpu_dir = os.path.join(SYSFS_CPU_DIR, f"cpu{cpu}")
+    with contextlib.suppress(OSError):
+        for name in os.listdir(cpu_dir):
+            if name.startswith("node") and name[len("node") :].isdigit():
+                return int(name[len("node") :])
+    return 0
+
+
+def get_cpu_nodes(skip_smt_siblings=False):
+    """Return a dict that maps the CPUs this process may use to NUMA nodes.
+
+    If *skip_smt_siblings* is True, only use the first hardware thread
+    of each physical core. Machines without topology information in
+    sysfs are treated as a single NUMA node without SMT.
+
+    """
+    allowed = os.sched_getaffinity(0)
+    cpu_nodes = {}
+    for cpu in sorted(allowed):
+        if skip_smt_siblings:
+            siblings = _read_cpu_file(cpu, "topology", "thread_siblings_list")
+            if siblings and min(set(parse_cpu_list(siblings)) & allowed) != cpu:
+                continue
+        cpu_nodes[cpu] = _get_numa_node(cpu)
+    return cpu_nodes
+
+
+class _Budget:
+    def __init__(self, cores, memory, cpu_nodes=None):
+        self.total_cores = cores
+        self.total_memory = memory
+        self.free_cores = cores
+        self.free_memory = memory
+        # Map from free CPUs to their NUMA nodes if tasks are pinned.
+        self.free_cpus = None if cpu_nodes is None else dict(cpu_nodes)
+
+    def get_needs(self, task):
+        # Tasks that exceed the total budget run when nothing else runs.
+        return (
+            min(task.cores, self.total_cores),
+            min(task.memory or 0, self.total_memory),
+        )
+
+    def fits(self, needs):
+        cores, memory = needs
+        return cores <= self.free_cores and memory <= self.free_memory
+
+    def acquire(self, needs):
+        """Reserve *needs* and return the CPUs for the task (None if unpinned)."""
+        cores, memory = needs
+        self.free_cores -= cores
+        self.free_memory -= memory
+        if self.free_cpus is None:
+            return None
+        return self._take_cpus(cores)
+
+    def release(self, needs, cpus):
+        cores, memory = needs
+        self.free_cores += cores
+        self.free_memory += memory
+        if cpus is not None:
+            self.free_cpus.update(cpus)
+
+    def _take_cpus(self, count):
+        cpus_by_node = defaultdict(list)
+        for cpu, node in sorted(self.free_cpus.items()):
+            cpus_by_node[node].append(cpu)
+        # Keep the task on a single NUMA node if possible. Choose the
+        # fullest node that has room to keep larger gaps for later tasks.
+        fitting = [cpus for cpus in cpus_by_node.values() if len(cpus) >= count]
+        if fitting:
+            cpus = min(fitting, key=len)[:count]
+        else:
+            cpus = sorted(self.free_cpus, key=lambda cpu: (self.free_cpus[cpu], cpu))
+            cpus = cpus[:count]
+        return {cpu: self.free_cpus.pop(cpu) for cpu in cpus}
+
+
+def _init_worker():
+    # Workers inherit the signal handlers of the main process, e.g., the one
+    # that stops a Slurm task. Let SIGTERM stop the workers silently.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+
+def _run_batch(func, task_ids, cpus):
+    if cpus is not None:
+        # The children of the worker, i.e., the run commands, inherit the
+        # affinity. The kernel allocates memory on the node of the CPU.
+        os.sched_setaffinity(0, cpus)
+    return [func(task_id) for task_id in task_ids]
+
+
+class Progress:
+    """Keep track of finished tasks and report the throughput.
+
+    If *progress_file* is given, regularly write the current numbers as
+    JSON to this file, so that other tools can poll it. The file is
+    replaced atomically.
+
+    """
+
+    def __init__(self, num_tasks, progress_file=None):
+        self.num_tasks = num_tasks
+        self.progress_file = progress_file
+        self.completed = 0
+        self.failed = 0
+        self.running = 0
+        self.start_time = time.monotonic()
+        self.last_log_time = self.start_time
+        self.last_write_time = None
+
+    def get_stats(self):
+        elapsed = time.monotonic() - self.start_time
+        runs_per_second = self.completed / elapsed if elapsed > 0 else 0.0
+        remaining = self.num_tasks - self.completed
+        eta = remaining / runs_per_second if runs_per_second else None
+        return {
+            "total": self.num_tasks,
+            "completed": self.completed,
+            "failed": self.failed,
+            "running": self.running,
+            "pending": remaining - self.running,
+            "elapsed": round(elapsed, 3),
+            "runs_per_second": round(runs_per_second, 3),
+            "eta": None if eta is None else round(eta, 3),
+            "updated": datetime.datetime.now().isoformat(timespec="seconds"),
+        }
+
+    def log(self):
+        stats = self.get_stats()
+        eta = stats["eta"]
+        eta = "unknown" if eta is None else datetime.timedelta(seconds=round(eta))
+        logging.info(
+            f"Progress: {stats['completed']}/{stats['total']} completed, "
+            f"{stats['running']} running, {stats['failed']} failed, "
+            f"{stats['runs_per_second']:.2f} runs/s, ETA: {eta}"
+        )
+
+    def write(self):
+        tmp_file = f"{self.progress_file}.tmp"
+        with open(tmp_file, "w") as f:
+            json.dump(self.get_stats(), f, indent=2)
+        os.replace(tmp_file, self.progress_file)
+
+    def update(self, force=False):
+        """Log and write the progress if enough time has passed."""
+        now = time.monotonic()
+        if force or now - self.last_log_time >= PROGRESS_INTERVAL:
+            self.log()
+            self.last_log_time = now
+        if self.progress_file and (
+            force
+            or self.last_write_time is None
+            or now - self.last_write_time >= PROGRESS_FILE_INTERVAL
+        ):
+            self.write()
+            self.last_write_time = now
+
+
+def run_tasks(
+    func,
+    tasks,
+    processes,
+    memory_budget=None,
+    progress_file=None,
+    cpu_nodes=None,
+    batch_time=None,
+):
+    """Call *func(task_id)* for all *tasks* in a pool of worker processes.
+
+    *tasks* is a list of :class:`Task` objects. A task only starts when
+    enough cores (at most *processes*) and memory (at most *memory_budget*
+    MiB, defaulting to the physical memory) are free. Tasks are started in
+    the given order, but a task may overtake earlier tasks that don't fit
+    into the remaining budget yet. Return the list of results in the order
+    of *tasks*.
+
+    Every :data:`PROGRESS_INTERVAL` seconds, log how many tasks are
+    completed, running and failed (i.e., returned a true value), the
+    throughput and the estimated remaining time. If *progress_file* is
+    given, also write these numbers to this JSON file.
+
+    If *cpu_nodes* is given (see :func:`get_cpu_nodes`), pin each task to
+    as many dedicated CPUs as it needs cores, preferably on the same NUMA
+    node.
+
+    By default, the tasks are handed to the workers one at a time. If
+    *batch_time* is given, a worker receives as many consecutive tasks
+    with the same needs as it can execute in about *batch_time* seconds,
+    judging by the average duration of the finished tasks. Batches never
+    contain more than half of the remaining tasks per process, so that
+    the workers finish at about the same time.
+
+    If the main process is interrupted, e.g., with Ctrl-C, terminate the
+    workers and re-raise the exception (e.g., :py:class:`KeyboardInterrupt`).
+
+    """
+    if memory_budget is None:
+        memory_budget = get_total_memory()
+    if cpu_nodes is not None and len(cpu_nodes) < processes:
+        logging.warning(
+            f"Only {len(cpu_nodes)} CPUs are available for pinning "
+            f"--> use {len(cpu_nodes)} instead of {processes} processes"
+        )
+        processes = len(cpu_nodes)
+    budget = _Budget(processes, memory_budget, cpu_nodes)
+
+    # Group the tasks by their needs. Then, we only have to compare the
+    # first tasks of all groups to find the next task that fits.
+    queues = defaultdict(deque)
+    for index, task in enumerate(tasks):
+        if task.cores > processes or (task.memory or 0) > memory_budget:
+            logging.warning(
+                f"Task {task.task_id} needs {task.cores} cores and {task.memory} MiB, "
+                f"which exceeds the budget of {processes} cores and "
+                f"{memory_budget} MiB --> run it when no other task runs"
+            )
+        queues[budget.get_needs(task)].append((index, task))
+
+    condition = threading.Condition()
+    results = {}
+    num_pending = len(tasks)
+    progress = Progress(len(tasks), progress_file=progress_file)
+    # Total duration of the finished batches and the number of their tasks.
+    finished_time = 0.0
+    num_finished_tasks = 0
+
+    def get_batch_size(num_queued):
+        if batch_time is None or not num_finished_tasks:
+            return 1
+        average_time = finished_time / num_finished_tasks
+        size = int(batch_time / average_time) if average_time > 0 else num_queued
+        return max(1, min(size, num_pending // (2 * processes)))
+
+    def pop_next_fitting_batch():
+        candidates = [
+            (needs, queue)
+            for needs, queue in queues.items()
+            if queue and budget.fits(needs)
+        ]
+        if not candidates:
+            return None, []
+        needs, queue = min(candidates, key=lambda item: item[1][0][0])
+        batch_size = min(get_batch_size(len(queue)), len(queue))
+        return needs, [queue.popleft()[1] for _ in range(batch_size)]
+
+    def make_callback(batch, needs, cpus, start_time):
+        def callback(batch_results):
+            nonlocal finished_time, num_finished_tasks
+            with condition:
+                for task, result in zip(batch, batch_results):
+                    results[task.task_id] = result
+                    if result:
+                        progress.failed += 1
+                budget.release(needs, cpus)
+                progress.running -= len(batch)
+                progress.completed += len(batch)
+                finished_time += time.monotonic() - start_time
+                num_finished_tasks += len(batch)
+                condition.notify()
+
+        return callback
+
+    def make_error_callback(batch, needs, cpus, start_time):
+        def error_callback(err):
+            task_ids = ", ".join(str(task.task_id) for task in batch)
+            logging.error(f"Task(s) {task_ids} failed: {err!r}")
+            make_callback(batch, needs, cpus, start_time)([True] * len(batch))
+
+        return error_callback
+
+    pool = multiprocessing.Pool(processes=processes, initializer=_init_worker)
+    try:
+        with condition:
+            while num_pending or progress.running:
+                needs, batch = pop_next_fitting_batch()
+                while batch:
+                    num_pending -= len(batch)
+                    progress.running += len(batch)
+                    cpus = budget.acquire(needs)
+                    args = (
+                        func,
+                        [task.task_id for task in batch],
+                        None if cpus is None else list(cpus),
+                    )
+                    start_time = time.monotonic()
+                    pool.apply_async(
+                        _run_batch,
+                        args,
+                        callback=make_callback(batch, needs, cpus, start_time),
+                        error_callback=make_error_callback(
+                            batch, needs, cpus, start_time
+                        ),
+                    )
+                    needs, batch = pop_next_fitting_batch()
+                progress.update()
+                # Use a timeout to be able to handle KeyboardInterrupts.
+                condition.wait(timeout=1)
+            progress.update(force=True)
+    except BaseException:
+        # E.g., Ctrl-C or a signal handler that stops the task.
+        logging.warning("Main script interrupted")
+        pool.terminate()
+        # Let the caller distinguish an interrupted from a finished execution.
+        raise
+    finally:
+        pool.close()
+        logging.info("Joining pool processes")
+        pool.join()
+
+    return [results.get(task.task_id) for task in tasks]
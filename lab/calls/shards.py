@@ -0,0 +1,139 @@
+"""Store finished run directories in a few archive shards.
+
+Experiments with many runs leave millions of small files on the shared
+filesystem. Instead, each Slurm task can pack its run directories into
+one uncompressed tar file in the directory :data:`SHARDS_DIRNAME`. The
+index next to each shard stores the offset and size of each regular file,
+so that single files can be read without scanning the archive. The parse
+step stores the parsed properties of the runs next to the shard.
+
+"""
+
+import json
+import os
+import tarfile
+
+#: Name of the experiment subdirectory that holds the shards.
+SHARDS_DIRNAME = "run-shards"
+INDEX_SUFFIX = ".index.json"
+PROPERTIES_SUFFIX = ".properties.json"
+
+
+def _write_json_atomically(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def pack_runs(exp_path, rel_run_dirs, shards_path):
+    """Pack the given run dirs of the experiment into a new shard.
+
+    The shard is named after the smallest and largest run dir. Its index
+    is written last, so only shards with an index are complete. Return
+    the path of the shard.
+
+    """
+    rel_run_dirs = sorted(
+        rel_run_dir
+        for rel_run_dir in rel_run_dirs
+        if os.path.exists(os.path.join(exp_path, rel_run_dir))
+    )
+    if not rel_run_dirs:
+        return None
+    os.makedirs(shards_path, exist_ok=True)
+    first, last = (os.path.basename(rel_run_dirs[i]) for i in [0, -1])
+    shard_path = os.path.join(shards_path, f"runs-{first}-{last}.tar")
+    # Runs that are executed again must not replace an older shard.
+    counter = 1
+    while os.path.exists(shard_path):
+        counter += 1
+        shard_path = os.path.join(shards_path, f"runs-{first}-{last}-{counter}.tar")
+    tmp_path = f"{shard_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        with tarfile.open(fileobj=f, mode="w") as tar:
+            for rel_run_dir in rel_run_dirs:
+                tar.add(os.path.join(exp_path, rel_run_dir), arcname=rel_run_dir)
+        # The run dirs are removed after packing them.
+        f.flush()
+        os.fsync(f.fileno())
+    with tarfile.open(tmp_path) as tar:
+        index = {
+            member.name: [member.offset_data, member.size]
+            for member in tar
+            if member.isfile()
+        }
+    os.replace(tmp_path, shard_path)
+    _write_json_atomically(shard_path + INDEX_SUFFIX, index)
+    return shard_path
+
+
+class Shard:
+    """Provide access to the run dirs stored in a shard."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path + INDEX_SUFFIX) as f:
+            self.index = json.load(f)
+        # Run dirs have the form "runs-00001-00100/00001".
+        self.run_dirs = sorted({"/".join(name.split("/")[:2]) for name in self.index})
+        self._properties = None
+
+    def read(self, name):
+        """Return the content of the file *name* as a string or None."""
+        if name not in self.index:
+            return None
+        offset, size = self.index[name]
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return f.read(size).decode(errors="replace")
+
+    def extract(self, dest):
+        """Extract the directories and regular files of the shard to *dest*.
+
+        Symbolic links are skipped, since they may point anywhere.
+
+        """
+        with tarfile.open(self.path) as tar:
+            members = [member for member in tar if member.isdir() or member.isfile()]
+            tar.extractall(dest, members=members)
+
+    def get_properties(self):
+        """Return the parsed properties of the runs (None if unparsed)."""
+        if self._properties is None:
+            path = self.path + PROPERTIES_SUFFIX
+            if os.path.exists(path):
+                with open(path) as f:
+                    self._properties = json.load(f)
+        return self._properties
+
+    def write_properties(self, properties):
+        """Store the parsed properties of the runs next to the shard."""
+        _write_json_atomically(self.path + PROPERTIES_SUFFIX, properties)
+        self._properties = properties
+
+
+def get_run_shards(exp_path):
+    """Return a dict that maps the packed run dirs to their shards.
+
+    If a run dir is stored in multiple shards, e.g., because the run has
+    been executed again, use the most recent shard.
+
+    """
+    shards_path = os.path.join(exp_path, SHARDS_DIRNAME)
+    if not os.path.isdir(shards_path):
+        return {}
+    shard_paths = [
+        os.path.join(shards_path, name)
+        for name in os.listdir(shards_path)
+        if name.endswith(".tar")
+        and os.path.exists(os.path.join(shards_path, name + INDEX_SUFFIX))
+    ]
+    run_shards = {}
+    for shard_path in sorted(shard_paths, key=os.path.getmtime):
+        shard = Shard(shard_path)
+        for run_dir in shard.run_dirs:
+            run_shards[run_dir] = shard
+    return run_shards
@@ -1,26 +1,175 @@
+"""Pack an experiment directory into a compressed tar archive.
+
+The tar stream is piped through a multi-threaded compressor (``pigz``,
+``xz -T`` or ``zstd -T``) if it is installed. Otherwise, the archive is
+compressed by :py:mod:`tarfile` in this process.
+
+"""
+
+import fnmatch
+import logging
+import os
 import shutil
+import subprocess
 import tarfile
+import time
 from pathlib import Path
-import logging
-import os
+
+#: Seconds between two progress lines in the log.
+PROGRESS_INTERVAL = 30
+
+#: Map from compression formats to the external compressor and its
+#: arguments for *threads* threads. The compressors read the tar stream
+#: from stdin and write to stdout.
+COMPRESSORS = {
+    "gz": ("pigz", lambda threads: ["-p", str(threads)]),
+    "xz": ("xz", lambda threads: [f"-T{threads}"]),
+    "zst": ("zstd", lambda threads: [f"-T{threads}", "-q"]),
+}
+
+#: Formats that :py:mod:`tarfile` can compress itself.
+STDLIB_FORMATS = ["gz", "xz"]
+
+
+def _get_num_cpus():
+    # Only use the CPUs of the Slurm job on shared nodes.
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count()
+
+
+class _Progress:
+    def __init__(self, excludes):
+        self.excludes = excludes
+        self.files = 0
+        self.size = 0
+        self.skipped = 0
+        self.start_time = time.monotonic()
+        self.last_log_time = self.start_time
+
+    def filter(self, tarinfo):
+        """Skip excluded members and log the progress regularly."""
+        if any(
+            fnmatch.fnmatch(tarinfo.name, pattern)
+            or fnmatch.fnmatch(os.path.basename(tarinfo.name), pattern)
+            for pattern in self.excludes
+        ):
+            self.skipped += 1
+            return None
+        self.files += 1
+        self.size += tarinfo.size
+        now = time.monotonic()
+        if now - self.last_log_time >= PROGRESS_INTERVAL:
+            self.log()
+            self.last_log_time = now
+        return tarinfo
+
+    def log(self):
+        elapsed = time.monotonic() - self.start_time
+        mib = self.size / 1024**2
+        throughput = mib / elapsed if elapsed > 0 else 0.0
+        logging.info(
+            f"Archived {self.files} files and dirs ({mib:.1f} MiB, "
+            f"{throughput:.1f} MiB/s), skipped {self.skipped} excluded ones"
+        )
+
 
 class CompressStep:
-    def __init__(self, lab_experiment, target_folder, tmp_folder = None):
+    """Pack the directory of *lab_experiment* into *target_folder*.
+
+    The archive is called ``<experiment name>.tar.<compression>``, where
+    *compression* is "gz", "xz" or "zst". If *tmp_folder* is given, the
+    archive is written there first and then moved to *target_folder*.
+
+    *excludes* is a list of glob patterns (e.g., ``["*.sas", "*/output"]``).
+    Files and directories whose path in the archive or whose name matches
+    one of the patterns are skipped.
+
+    The external compressor uses *threads* threads (default: the number
+    of CPUs that this process may use). The progress is logged every
+    :data:`PROGRESS_INTERVAL` seconds. ::
+
+        exp.add_step(
+            "compress",
+            CompressStep(exp, "/nfs/archive", compression="zst", excludes=["*.sas"]),
+        )
+
+    """
+
+    def __init__(
+        self,
+        lab_experiment,
+        target_folder,
+        tmp_folder=None,
+        compression="gz",
+        excludes=None,
+        threads=None,
+    ):
+        if compression not in COMPRESSORS:
+            raise ValueError(
+                f"Unknown compression {compression!r}. "
+                f"Choose one of {sorted(COMPRESSORS)}."
+            )
         self.lab_experiment = lab_experiment
         self.target_folder = target_folder
         self.tmp_folder = tmp_folder
+        self.compression = compression
+        self.excludes = excludes or []
+        self.threads = threads or _get_num_cpus()
+
+    def _get_compressor(self):
+        """Return the command of the external compressor (None if missing)."""
+        name, get_args = COMPRESSORS[self.compression]
+        path = shutil.which(name)
+        if path is None:
+            return None
+        return [path, "-c", *get_args(self.threads)]
+
+    def _write_archive(self, output_filename, progress):
+        exp_path = self.lab_experiment.path
+        arcname = os.path.basename(exp_path)
+        compressor = self._get_compressor()
+        if compressor is None:
+            if self.compression not in STDLIB_FORMATS:
+                logging.critical(
+                    f"Compressing with {self.compression} needs "
+                    f"{COMPRESSORS[self.compression][0]}, which is not installed."
+                )
+            logging.info(
+                f"{COMPRESSORS[self.compression][0]} is not installed "
+                f"--> compress with a single thread"
+            )
+            with tarfile.open(output_filename, f"w:{self.compression}") as tar:
+                tar.add(exp_path, arcname=arcname, filter=progress.filter)
+            return
+
+        logging.info(f"Compressing with {' '.join(compressor)}")
+        with open(output_filename, "wb") as output:
+            proc = subprocess.Popen(compressor, stdin=subprocess.PIPE, stdout=output)
+            try:
+                with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+                    tar.add(exp_path, arcname=arcname, filter=progress.filter)
+            finally:
+                proc.stdin.close()
+                retcode = proc.wait()
+        if retcode != 0:
+            logging.critical(f"{compressor[0]} failed with exit code {retcode}.")
 
     def __call__(self):
         if not os.path.exists(self.lab_experiment.path):
-            logging.critical(f"Compress step could not find data at: {self.lab_experiment.path}.")
+            logging.critical(
+                f"Compress step could not find data at: {self.lab_experiment.path}."
+            )
+        filename = f"{self.lab_experiment.name}.tar.{self.compression}"
         if self.tmp_folder:
             Path(self.tmp_folder).mkdir(parents=True, exist_ok=True)
-            output_filename = f"{self.tmp_folder}/{self.lab_experiment.name}.tar.gz"
+            output_filename = f"{self.tmp_folder}/{filename}"
         else:
-            output_filename = f"{self.target_folder}/{self.lab_experiment.name}.tar.gz"
+            output_filename = f"{self.target_folder}/{filename}"
 
-        with tarfile.open(output_filename, "w:gz") as tar:
-            tar.add(self.lab_experiment.path, arcname=os.path.basename(self.lab_experiment.path))
+        progress = _Progress(self.excludes)
+        self._write_archive(output_filename, progress)
+        progress.log()
 
         if self.tmp_folder:
-            shutil.move(output_filename, f"{self.target_folder}/{self.lab_experiment.name}.tar.gz")
+            shutil.move(output_filename, f"{self.target_folder}/{filename}")
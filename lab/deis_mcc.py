@@ -4,7 +4,19 @@ import re
 from lab.compress_step import CompressStep
 
 class DEISSlurmEnvironment(SlurmEnvironment):
-    """Environment for DEIS cluster."""
+    """Environment for DEIS cluster.
+
+    The cluster has the partitions "naples", "rome", "dhabi" and "genoa".
+    Use the *job_settings* parameter of
+    :py:class:`~lab.environments.SlurmEnvironment` to execute some runs,
+    e.g., the runs of a memory-hungry algorithm, on another partition::
+
+        env = DEISSlurmEnvironment(
+            job_settings=lambda props: {"partition": "rome"}
+            if props["algorithm"] == "lmcut"
+            else None
+        )
+    """
 
     DEFAULT_PARTITION = "naples"
     DEFAULT_QOS = "normal"
@@ -44,6 +56,11 @@ class DEISSlurmEnvironment(SlurmEnvironment):
         return cls.is_cluster_main() or cls.is_cluster_dhabi() or cls.is_cluster_naples() or cls.is_cluster_rome() or cls.is_cluster_genoa()
 
     @classmethod
-    def compress_step(cls, lab_experiment, username):
-        return CompressStep(lab_experiment, f'/nfs/home/cs.aau.dk/{username}', f'/scratch/{username}/')
+    def compress_step(cls, lab_experiment, username, **kwargs):
+        return CompressStep(
+            lab_experiment,
+            f'/nfs/home/cs.aau.dk/{username}',
+            f'/scratch/{username}/',
+            **kwargs,
+        )
 
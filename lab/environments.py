@@ -1,3 +1,5 @@
+import copy
+import heapq
 import logging
 import math
 import multiprocessing
@@ -7,8 +9,11 @@ import random
 import re
 import subprocess
 import sys
+from collections import defaultdict
+from pathlib import Path
 
-from lab import tools
+from lab import monitor, tools
+from lab.calls import executor, runtime
 
 
 def _get_job_prefix(exp_name):
@@ -17,6 +22,133 @@ def _get_job_prefix(exp_name):
     return "".join([escape_char, exp_name, "-"])
 
 
+def _get_duration_bucket(duration):
+    """Group durations into buckets whose bounds grow exponentially.
+
+    >>> [_get_duration_bucket(d) for d in [0, 0.5, 1, 3, 4, 1800]]
+    [0, 0, 0, 1, 2, 10]
+    """
+    return max(0, math.floor(math.log2(duration))) if duration > 0 else 0
+
+
+def get_longest_first_order(expected_durations, randomize=True):
+    """Return run IDs sorted by decreasing expected duration.
+
+    *expected_durations* maps run IDs to expected durations in seconds.
+    Runs with unknown duration (None) come first, since they might take
+    long. If *randomize* is True, the order of runs with similar expected
+    durations (see _get_duration_bucket()) is random.
+
+    >>> get_longest_first_order({1: 5, 2: 100, 3: None, 4: 90}, randomize=False)
+    [3, 2, 4, 1]
+    """
+
+    def get_key(run_id):
+        duration = expected_durations[run_id]
+        if duration is None:
+            return (0, 0)
+        if randomize:
+            return (1, -_get_duration_bucket(duration), random.random())
+        return (1, -duration)
+
+    return sorted(expected_durations, key=get_key)
+
+
+def get_expected_durations(runs, properties, attribute):
+    """Predict the duration of each run from the *properties* of an old experiment.
+
+    Use the value of *attribute* for the same run (identified by the run
+    ID) if it's known. Otherwise, use the average duration of all runs with
+    the same algorithm and domain, and then the average duration of all
+    runs with the same algorithm. Return a dictionary that maps run IDs
+    (1-based indices into *runs*) to the expected durations or None.
+
+    """
+    by_algorithm_and_domain = defaultdict(list)
+    by_algorithm = defaultdict(list)
+    for props in properties.values():
+        duration = props.get(attribute)
+        if duration is None:
+            continue
+        algorithm = props.get("algorithm")
+        by_algorithm_and_domain[(algorithm, props.get("domain"))].append(duration)
+        by_algorithm[algorithm].append(duration)
+
+    def get_average(durations):
+        return sum(durations) / len(durations) if durations else None
+
+    expected_durations = {}
+    for run_id, run in enumerate(runs, start=1):
+        old_props = properties.get("-".join(run.properties.get("id", [])), {})
+        algorithm = run.properties.get("algorithm")
+        domain = run.properties.get("domain")
+        duration = old_props.get(attribute)
+        if duration is None:
+            duration = get_average(by_algorithm_and_domain.get((algorithm, domain)))
+        if duration is None:
+            duration = get_average(by_algorithm.get(algorithm))
+        expected_durations[run_id] = duration
+    return expected_durations
+
+
+def _read_expected_durations(runs, durations_file, attribute):
+    path = Path(durations_file)
+    if path.is_dir():
+        path = path / "properties"
+    if not path.is_file():
+        logging.critical(f"Properties file for run durations not found: {path}")
+    return get_expected_durations(runs, tools.Properties(filename=path), attribute)
+
+
+def get_time_limit_durations(runs):
+    """Use the sum of the time limits of each run's commands as its duration.
+
+    Return a dictionary that maps run IDs (1-based indices into *runs*)
+    to the expected durations or None if a command has no time limit.
+
+    """
+    expected_durations = {}
+    for run_id, run in enumerate(runs, start=1):
+        time_limits = [kwargs.get("time_limit") for _, kwargs in run.commands.values()]
+        if not time_limits or None in time_limits:
+            expected_durations[run_id] = None
+        else:
+            expected_durations[run_id] = sum(time_limits)
+    return expected_durations
+
+
+def group_runs_by_duration(expected_durations, task_duration, max_tasks):
+    """Distribute runs to tasks that take about *task_duration* seconds each.
+
+    *expected_durations* maps run IDs to expected durations in seconds.
+    Runs with unknown duration (None) are assumed to take as long as the
+    longest known run. Use as many tasks as needed to stay below
+    *task_duration*, but at most *max_tasks*, and assign each run
+    (longest first) to the task with the smallest total duration so far.
+    Return the list of tasks, each a sorted list of run IDs.
+
+    >>> group_runs_by_duration({1: 50, 2: 20, 3: 30, 4: None}, 100, 10)
+    [[1, 3], [2, 4]]
+    >>> group_runs_by_duration({1: 50, 2: 20, 3: 30, 4: 50}, 100, 1)
+    [[1, 2, 3, 4]]
+    """
+    known_durations = [d for d in expected_durations.values() if d is not None]
+    default_duration = max(known_durations, default=task_duration)
+    durations = {
+        run_id: default_duration if duration is None else duration
+        for run_id, duration in expected_durations.items()
+    }
+    num_tasks = math.ceil(sum(durations.values()) / task_duration)
+    num_tasks = max(1, min(num_tasks, max_tasks, len(durations)))
+    tasks = [[] for _ in range(num_tasks)]
+    loads = [(0, task_index) for task_index in range(num_tasks)]
+    for run_id in sorted(durations, key=lambda run_id: (-durations[run_id], run_id)):
+        load, task_index = heapq.heappop(loads)
+        tasks[task_index].append(run_id)
+        heapq.heappush(loads, (load + durations[run_id], task_index))
+    return sorted(sorted(task) for task in tasks)
+
+
 def is_build_step(step):
     """Return true iff the given step is the "build" step."""
     return step._funcname == "build"
@@ -27,10 +159,37 @@ def is_run_step(step):
     return step._funcname == "start_runs"
 
 
+def is_parse_step(step):
+    """Return true iff the given step is the "parse" step."""
+    return step._funcname == "parse"
+
+
+def is_resubmit_step(step):
+    """Return true iff the given step executes unfinished runs again."""
+    return step._funcname == "resubmit_runs"
+
+
+#: Attributes of Slurm environments that *job_settings* may override.
+JOB_SETTINGS = [
+    "partition",
+    "qos",
+    "time_limit_per_task",
+    "memory_per_cpu",
+    "cpus_per_task",
+    "extra_options",
+]
+
+
+def _is_run_job(step):
+    return is_run_step(step) or is_resubmit_step(step)
+
+
 class Environment:
     """Abstract base class for all environments."""
 
-    def __init__(self, randomize_task_order=True):
+    def __init__(
+        self, randomize_task_order=True, fsync="always", calibrate_nodes=False
+    ):
         """
         If *randomize_task_order* is True (default), tasks for runs are
         started in a random order. This is useful to avoid systematic
@@ -39,9 +198,31 @@ class Environment:
         run directories may be pristine while the experiment is running
         even though the logs say the runs are finished.
 
+        *fsync* controls when the outputs of the runs are synced to
+        disk. By default ("always"), the output files of each command
+        are synced when the command finishes. This is safe, but on
+        network filesystems it can cost more time than very short runs
+        need. Use "run" to sync the files once per run, "task" to sync
+        the files of all runs of a task (a Slurm task or the whole local
+        experiment) once after these runs and "never" to leave it to the
+        operating system.
+
+        Cluster nodes with different CPUs need different times for the
+        same run. If *calibrate_nodes* is True, each task (a Slurm task or
+        the whole local experiment) first measures how fast the node
+        executes a fixed benchmark and each run logs this "node speed".
+        The :py:class:`~downward.parsers.planner_parser.PlannerParser`
+        stores it in the ``node_speed`` attribute, which the report filter
+        :py:class:`~lab.reports.filter.NormalizeTimes` uses to make times
+        from different nodes comparable.
+
         """
+        if fsync not in runtime.FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {runtime.FSYNC_POLICIES}.")
         self.exp = None
         self.randomize_task_order = randomize_task_order
+        self.fsync = fsync
+        self.calibrate_nodes = calibrate_nodes
 
     def _get_task_order(self, num_tasks):
         task_order = list(range(1, num_tasks + 1))
@@ -58,6 +239,15 @@ class Environment:
         """
         raise NotImplementedError
 
+    def resubmit_runs(self, include_failed=False):
+        """Execute the runs again that didn't finish."""
+        run_ids = executor.reset_unfinished_runs(
+            self.exp.path, len(self.exp.runs), include_failed=include_failed
+        )
+        logging.info(f"Executing {len(run_ids)} runs again")
+        if run_ids:
+            self.start_runs()
+
     def run_steps(self):
         raise NotImplementedError
 
@@ -69,11 +259,69 @@ class LocalEnvironment(Environment):
 
     EXP_RUN_SCRIPT = "run"
 
-    def __init__(self, processes=None, **kwargs):
+    def __init__(
+        self,
+        processes=None,
+        memory_budget=None,
+        durations_file=None,
+        duration_attribute=None,
+        pin_cpus=False,
+        skip_smt_siblings=False,
+        batch_time=None,
+        **kwargs,
+    ):
         """
         If given, *processes* must be between 1 and #CPUs. If omitted,
         it will be set to #CPUs.
 
+        A run is only started when enough cores and memory are free. By
+        default, each run needs one core and the memory given by the
+        highest ``memory_limit`` of its commands (see
+        :py:meth:`~lab.experiment.Run.add_command`). *processes* sets the
+        number of available cores and *memory_budget* sets the available
+        memory in MiB. It defaults to the physical memory of the machine.
+
+        By default, runs are handed to the workers one at a time. To avoid
+        that a few long runs started at the end leave most cores idle,
+        you can start the runs in order of decreasing expected duration.
+        To do so, set *durations_file* to the evaluation directory or
+        properties file of a previous experiment and let
+        *duration_attribute* name the attribute that holds the duration
+        of a run. Runs without a known duration are predicted by the
+        average duration of the runs with the same algorithm and domain,
+        or with the same algorithm. Runs that still have an unknown
+        duration are started first. If *randomize_task_order* is True,
+        runs with similar expected durations are started in random order.
+
+        While the experiment runs, the main script regularly logs the
+        number of completed, running and failed runs, the throughput and
+        the estimated remaining time. It also writes these numbers to the
+        JSON file ``progress.json`` in the experiment directory.
+        Started and finished runs are recorded in the journal
+        ``run-journal.jsonl``. If the experiment is interrupted, starting
+        it again skips the finished runs and reruns the interrupted ones.
+
+        To reduce timing noise, set *pin_cpus* to True. Then each run is
+        pinned to as many dedicated CPUs as it needs cores, preferably
+        on a single NUMA node, and the kernel allocates its memory on
+        this node. If *skip_smt_siblings* is True, only one hardware
+        thread of each physical core is used, which may reduce the
+        number of processes. The CPUs of a run are logged to its
+        ``driver.log`` file.
+
+        For runs that only take milliseconds, the overhead of handing
+        each run to a worker process dominates. If *batch_time* is given,
+        the main script measures the average run duration and hands out
+        as many runs at once as a worker can execute in about
+        *batch_time* seconds.
+
+        >>> env = LocalEnvironment(batch_time=1)
+
+        >>> env = LocalEnvironment(
+        ...     durations_file="path/to/old-exp-eval",
+        ...     duration_attribute="planner_wall_clock_time",
+        ... )
+
         See :py:class:`~lab.environments.Environment` for inherited
         parameters.
 
@@ -85,12 +333,40 @@ class LocalEnvironment(Environment):
         if not 1 <= processes <= cores:
             raise ValueError("processes must be in the range [1, ..., #CPUs].")
         self.processes = processes
+        self.memory_budget = memory_budget
+        if (durations_file is None) != (duration_attribute is None):
+            raise ValueError(
+                "durations_file and duration_attribute must be given together."
+            )
+        self.durations_file = durations_file
+        self.duration_attribute = duration_attribute
+        if skip_smt_siblings and not pin_cpus:
+            raise ValueError("skip_smt_siblings requires pin_cpus.")
+        self.pin_cpus = pin_cpus
+        self.skip_smt_siblings = skip_smt_siblings
+        self.batch_time = batch_time
+
+    def _get_task_order(self, num_tasks):
+        if self.durations_file is None:
+            return super()._get_task_order(num_tasks)
+        expected_durations = _read_expected_durations(
+            self.exp.runs, self.durations_file, self.duration_attribute
+        )
+        return get_longest_first_order(
+            expected_durations, randomize=self.randomize_task_order
+        )
 
     def write_main_script(self):
         script = tools.fill_template(
             "local-job.py",
             task_order=self._get_task_order(len(self.exp.runs)),
             processes=self.processes,
+            memory_budget=self.memory_budget,
+            pin_cpus=self.pin_cpus,
+            skip_smt_siblings=self.skip_smt_siblings,
+            batch_time=self.batch_time,
+            fsync=self.fsync,
+            calibrate_nodes=self.calibrate_nodes,
         )
 
         self.exp.add_new_file("", self.EXP_RUN_SCRIPT, script, permissions=0o755)
@@ -222,10 +498,115 @@ class SlurmEnvironment(Environment):
         # Load Singularity module.
         setup="module load Singularity/2.6.1 2> /dev/null"
 
+    By default, the runs write their files directly to the experiment
+    directory on the shared filesystem. If *scratch_dir* is given, each
+    Slurm task copies its run directories to a new directory below
+    *scratch_dir* on the compute node, executes the runs there and copies
+    the run directories back when all runs of the task are finished (or
+    Slurm stops the task). The copies link to all other files of the
+    experiment directory, e.g., the solver code, so runs can use them as
+    before. Environment variables are expanded on the compute node::
+
+        scratch_dir="$TMPDIR"
+        scratch_dir="/scratch/$USER"
+
+    Each run leaves many small files in its run directory. If
+    *pack_runs* is True, each Slurm task packs its finished run
+    directories into a tar file (a "shard") in the ``run-shards``
+    directory of the experiment and removes the run directories. The
+    parse step and the fetcher read the runs from the shards.
+
+    By default, each Slurm task executes a fixed range of runs, so a task
+    that gets many long runs may finish long after all others. If
+    *pull_runs* is True, the Slurm tasks instead claim one run after the
+    other from a shared queue (a locked file in the experiment directory)
+    until all runs have been claimed.
+
+    By default, each Slurm task executes its runs one after the other
+    and *cpus_per_task* only reserves cores (and memory) for a single run.
+    If *parallel_runs* is True, each Slurm task executes up to
+    *cpus_per_task* runs concurrently, like the
+    :py:class:`~lab.environments.LocalEnvironment`: a run only starts
+    when enough of the task's cores and memory (*cpus_per_task* *
+    *memory_per_cpu*) are free for it. Each task then gets
+    *cpus_per_task* times more runs. This allows requesting whole nodes,
+    e.g., with 128 cores::
+
+        env = BaselSlurmEnvironment(
+            partition="infai_3",
+            cpus_per_task=128,
+            parallel_runs=True,
+        )
+
     Slurm limits the number of job array tasks. You must set the
     appropriate value for your cluster in the *MAX_TASKS* class
-    variable. Lab groups `ceil(runs/MAX_TASKS)` runs in one array
-    task.
+    variable. By default, Lab groups `ceil(runs/MAX_TASKS)` runs in one
+    array task.
+
+    If *task_duration* is given, Lab instead chooses the number of tasks
+    such that each task takes about *task_duration* seconds (at most
+    *MAX_TASKS* tasks) and distributes the runs to the tasks by their
+    expected durations, longest runs first. The expected duration of a
+    run is taken from an old experiment if *durations_file* and
+    *duration_attribute* are given (see
+    :py:class:`~lab.environments.LocalEnvironment`) and otherwise from
+    the sum of the ``time_limit`` values of its commands. Runs with
+    unknown duration are assumed to take as long as the longest known
+    run. With *parallel_runs*, each task may take *cpus_per_task* times
+    as many runs. Choose a *task_duration* that is well below
+    *time_limit_per_task*::
+
+        env = BaselSlurmEnvironment(
+            partition="infai_3",
+            time_limit_per_task="4:00:00",
+            task_duration=3 * 3600,
+        )
+
+    Other steps are executed by a single Slurm task. For experiments with
+    many runs, you can distribute the
+    :meth:`~lab.experiment.Experiment.parse` step to *parse_tasks* array
+    tasks. Each task parses every *parse_tasks*-th run directory and shard,
+    and an additional job merges the results into a ``properties`` file in
+    the experiment directory, from which the fetcher reads all runs at
+    once.
+
+    The runs of an experiment may need different resources, e.g., some
+    algorithms need more memory than others. If *job_settings* is given,
+    it must be a function that receives the properties of a run (see
+    :py:meth:`~lab.experiment.Run.set_property`) and returns a dict that
+    overrides some of the parameters *partition*, *qos*,
+    *time_limit_per_task*, *memory_per_cpu*, *cpus_per_task* and
+    *extra_options* for this run (or None to use the defaults). Runs
+    with the same settings are executed by the same job array. All of
+    these jobs may run at the same time and the following steps wait for
+    all of them. Example::
+
+        def get_job_settings(run_properties):
+            if run_properties["algorithm"] == "blind":
+                return {"partition": "infai_2", "memory_per_cpu": "6354M"}
+            return None
+
+        env = BaselSlurmEnvironment(
+            partition="infai_1", job_settings=get_job_settings
+        )
+
+    By default, each step gets its own Slurm job, which waits for the
+    job of the previous step. If *combine_steps* is True, consecutive
+    steps that don't execute runs (e.g., the parse, fetch and report
+    steps) are executed by a single job, one after the other. This
+    reduces the number of jobs and the time for submitting them. Unlike
+    separate jobs, the combined job stops at the first failing step.
+
+    The IDs of the submitted jobs are stored in the job directory, so
+    that :func:`lab.monitor.print_status` can report the progress of the
+    experiment.
+
+    If runs never start or are killed, e.g., because a node fails, the
+    step :meth:`~lab.experiment.Experiment.resubmit_runs` submits a
+    new job array for only these runs. It reuses the job directory of
+    the experiment and the following steps wait for the new job. The
+    step aborts while earlier jobs of the experiment are still pending
+    or running.
 
     See :py:class:`~lab.environments.Environment` for inherited
     parameters.
@@ -261,6 +642,16 @@ class SlurmEnvironment(Environment):
         cpus_per_task=1,
         export=None,
         setup=None,
+        scratch_dir=None,
+        pack_runs=False,
+        pull_runs=False,
+        parallel_runs=False,
+        task_duration=None,
+        durations_file=None,
+        duration_attribute=None,
+        parse_tasks=1,
+        job_settings=None,
+        combine_steps=False,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -288,6 +679,33 @@ class SlurmEnvironment(Environment):
         self.cpus_per_task = cpus_per_task
         self.export = export
         self.setup = setup
+        self.scratch_dir = scratch_dir
+        self.pack_runs = pack_runs
+        self.pull_runs = pull_runs
+        if pull_runs and parallel_runs:
+            raise ValueError("pull_runs and parallel_runs can't be combined.")
+        self.parallel_runs = parallel_runs
+        if task_duration is not None and task_duration <= 0:
+            raise ValueError("task_duration must be positive.")
+        if (durations_file is None) != (duration_attribute is None):
+            raise ValueError(
+                "durations_file and duration_attribute must be given together."
+            )
+        self.task_duration = task_duration
+        self.durations_file = durations_file
+        self.duration_attribute = duration_attribute
+        if parse_tasks < 1:
+            raise ValueError("parse_tasks must be at least 1.")
+        self.parse_tasks = parse_tasks
+        if pull_runs and job_settings is not None:
+            raise ValueError("pull_runs and job_settings can't be combined.")
+        self.job_settings = job_settings
+        self.combine_steps = combine_steps
+        # Map from step names to the run IDs of each Slurm task.
+        self._run_groups = {}
+        # IDs of the runs in the current run job (None for all runs).
+        self._run_ids = None
+        self._job_name_suffix = ""
 
     @staticmethod
     def _get_memory_in_kb(limit):
@@ -314,18 +732,61 @@ class SlurmEnvironment(Environment):
         return (
             f"{_get_job_prefix(self.exp.name)}"
             f"{self.exp.steps.index(step) + 1:02d}-{step.name}"
+            f"{self._job_name_suffix}"
         )
 
-    def _get_num_runs_per_task(self):
-        return math.ceil(len(self.exp.runs) / self.MAX_TASKS)
+    def _get_num_runs_per_task(self, num_runs):
+        runs_per_task = math.ceil(num_runs / self.MAX_TASKS)
+        if self.parallel_runs:
+            runs_per_task *= self.cpus_per_task
+        return runs_per_task
+
+    def _get_expected_durations(self):
+        expected_durations = get_time_limit_durations(self.exp.runs)
+        if self.durations_file is not None:
+            old_durations = _read_expected_durations(
+                self.exp.runs, self.durations_file, self.duration_attribute
+            )
+            for run_id, duration in old_durations.items():
+                if duration is not None:
+                    expected_durations[run_id] = duration
+        return expected_durations
+
+    def _get_run_groups(self, step):
+        """Return the run IDs of each task (None for ranges of run IDs)."""
+        if self._run_ids is not None:
+            run_ids = self._run_ids
+        elif self.task_duration is not None:
+            run_ids = list(range(1, len(self.exp.runs) + 1))
+        else:
+            return None
+        if step.name not in self._run_groups:
+            if self.task_duration is None:
+                size = self._get_num_runs_per_task(len(run_ids))
+                run_groups = [
+                    run_ids[i : i + size] for i in range(0, len(run_ids), size)
+                ]
+            else:
+                expected_durations = self._get_expected_durations()
+                capacity = self.task_duration
+                if self.parallel_runs:
+                    capacity *= self.cpus_per_task
+                run_groups = group_runs_by_duration(
+                    {run_id: expected_durations[run_id] for run_id in run_ids},
+                    capacity,
+                    self.MAX_TASKS,
+                )
+            self._run_groups[step.name] = run_groups
+        return self._run_groups[step.name]
 
     def _get_num_tasks(self, step):
-        if is_run_step(step):
-            num_runs = len(self.exp.runs)
-            num_tasks = math.ceil(num_runs / self._get_num_runs_per_task())
-        else:
-            num_tasks = 1
-        return num_tasks
+        if not _is_run_job(step):
+            return 1
+        run_groups = self._get_run_groups(step)
+        if run_groups is not None:
+            return len(run_groups)
+        num_runs = len(self.exp.runs)
+        return math.ceil(num_runs / self._get_num_runs_per_task(num_runs))
 
     def _get_job_header(self, step, is_last):
         job_params = self._get_job_params(step, is_last)
@@ -334,33 +795,146 @@ class SlurmEnvironment(Environment):
     def _get_run_job_body(self, run_step):
         num_runs = len(self.exp.runs)
         num_tasks = self._get_num_tasks(run_step)
-        logging.info(f"Grouping {num_runs} runs into {num_tasks} Slurm tasks.")
+        run_groups = self._get_run_groups(run_step)
+        num_step_runs = num_runs if run_groups is None else sum(map(len, run_groups))
+        logging.info(f"Grouping {num_step_runs} runs into {num_tasks} Slurm tasks.")
+        # The run queue hands out all runs, so subsets of runs are listed.
+        pull_runs = self.pull_runs and self._run_ids is None
+        if pull_runs:
+            run_ids = ""
+        elif run_groups is not None:
+            run_ids = "$(shuf -e ${TASK_RUN_IDS[$TASK_ID - 1]})"
+        else:
+            run_ids = "$(seq $FIRST_RUN_ID $LAST_RUN_ID | shuf)"
         return tools.fill_template(
             self.RUN_JOB_BODY_TEMPLATE_FILE,
             exp_path="../" + self.exp.name,
             num_runs=num_runs,
             python=tools.get_python_executable(),
-            runs_per_task=self._get_num_runs_per_task(),
+            runs_per_task=self._get_num_runs_per_task(num_runs),
+            fsync=self.fsync,
+            executor_options=self._get_executor_options(pull_runs),
+            task_run_ids=" ".join(
+                '"{}"'.format(" ".join(str(run_id) for run_id in run_group))
+                for run_group in run_groups or []
+            ),
+            run_ids=run_ids,
             task_order=" ".join(str(i) for i in self._get_task_order(num_tasks)),
         )
 
-    def _get_step_job_body(self, step):
+    def _get_soft_memory_limit(self):
+        """Return the soft memory limit for a Slurm task in KiB."""
+        memory_per_cpu_kb = SlurmEnvironment._get_memory_in_kb(self.memory_per_cpu)
+        return int(self.cpus_per_task * memory_per_cpu_kb * 0.98)
+
+    def _get_executor_options(self, pull_runs):
+        options = []
+        if self.calibrate_nodes:
+            options.append("--calibrate ")
+        if self.pack_runs:
+            options.append("--pack ")
+        if self.scratch_dir is not None:
+            options.append(f'--scratch "{self.scratch_dir}" ')
+        if pull_runs:
+            # Each submission needs a new queue, since the runs of earlier
+            # queues have already been claimed.
+            options.append(f"--pull {random.randrange(1, 2**31)} ")
+            if not self.randomize_task_order:
+                options.append("--ordered ")
+        if self.parallel_runs:
+            options.append(
+                f"--processes {self.cpus_per_task} "
+                f"--memory-budget {self._get_soft_memory_limit() // 1024} "
+            )
+        return "".join(options)
+
+    def _get_step_job_body(self, steps, parse_part=None):
+        """Return the body of a job that executes the *steps* in order."""
+        step_setup = ""
+        if parse_part is not None:
+            from lab.experiment import PARSE_PART_VARIABLE
+
+            step_setup = f'export {PARSE_PART_VARIABLE}="{parse_part}"\n'
         return tools.fill_template(
             self.STEP_JOB_BODY_TEMPLATE_FILE,
             cwd=os.getcwd(),
             python=tools.get_python_executable(),
             script=sys.argv[0],
-            step_name=step.name,
+            step_names=" ".join(f'"{step.name}"' for step in steps),
+            step_setup=step_setup,
         )
 
     def _get_job_body(self, step):
-        if is_run_step(step):
+        if _is_run_job(step):
             return self._get_run_job_body(step)
-        return self._get_step_job_body(step)
+        return self._get_step_job_body([step])
 
     def _get_job(self, step, is_last):
         return f"{self._get_job_header(step, is_last)}\n\n{self._get_job_body(step)}"
 
+    def _group_runs_by_settings(self, run_ids):
+        """Return pairs of job settings and the IDs of the runs using them."""
+        if self.job_settings is None:
+            return [({}, run_ids)]
+        if run_ids is None:
+            run_ids = range(1, len(self.exp.runs) + 1)
+        groups = {}
+        for run_id in run_ids:
+            settings = self.job_settings(self.exp.runs[run_id - 1].properties) or {}
+            unknown = set(settings) - set(JOB_SETTINGS)
+            if unknown:
+                logging.critical(f"Unknown job settings: {sorted(unknown)}")
+            key = tuple(sorted(settings.items()))
+            groups.setdefault(key, []).append(run_id)
+        return [(dict(key), group_run_ids) for key, group_run_ids in groups.items()]
+
+    def _get_run_jobs(self, step, is_last, run_ids=None):
+        """Return the names and contents of the jobs that execute the runs.
+
+        If *run_ids* is None, execute all runs. There is one job for each
+        combination of job settings, and the jobs may run in parallel.
+
+        """
+        groups = self._group_runs_by_settings(run_ids)
+        jobs = []
+        for index, (settings, group_run_ids) in enumerate(groups, start=1):
+            env = copy.copy(self)
+            for name, value in settings.items():
+                setattr(env, name, value)
+            env._run_ids = group_run_ids
+            env._run_groups = {}
+            if len(groups) > 1:
+                env._job_name_suffix = f"-{index}-{env.partition}"
+            jobs.append((env._get_job_name(step), env._get_job(step, is_last)))
+        return jobs
+
+    def _get_combined_job(self, steps, is_last):
+        """Return the name and content of a job that executes all *steps*."""
+        if len(steps) == 1:
+            return self._get_job_name(steps[0]), self._get_job(steps[0], is_last)
+        job_name = f"{self._get_job_name(steps[0])}-to-{steps[-1].name}"
+        job_params = self._get_job_params(steps[0], is_last)
+        job_params["name"] = job_name
+        header = tools.fill_template(self.JOB_HEADER_TEMPLATE_FILE, **job_params)
+        return job_name, f"{header}\n\n{self._get_step_job_body(steps)}"
+
+    def _get_parse_jobs(self, step, is_last):
+        """Return the names and contents of the parse and merge jobs."""
+        job_name = self._get_job_name(step)
+        job_params = self._get_job_params(step, is_last=False)
+        job_params["num_tasks"] = self.parse_tasks
+        parse_header = tools.fill_template(self.JOB_HEADER_TEMPLATE_FILE, **job_params)
+        parse_part = f"$SLURM_ARRAY_TASK_ID/{self.parse_tasks}"
+        parse_body = self._get_step_job_body([step], parse_part)
+        parse_job = f"{parse_header}\n\n{parse_body}"
+        merge_params = self._get_job_params(step, is_last)
+        merge_params["name"] = f"{job_name}-merge"
+        merge_header = tools.fill_template(
+            self.JOB_HEADER_TEMPLATE_FILE, **merge_params
+        )
+        merge_job = f"{merge_header}\n\n{self._get_step_job_body([step], 'merge')}"
+        return [(job_name, parse_job), (merge_params["name"], merge_job)]
+
     def write_main_script(self):
         # The main script is written by the run_steps() method.
         pass
@@ -373,9 +947,20 @@ class SlurmEnvironment(Environment):
         """
         self.exp.build(write_to_disk=False)
 
-        # Prepare job dir.
+        # Prepare job dir. Keep the job files, logs and job IDs of the
+        # experiment unless all runs are submitted again, e.g., when
+        # resubmitting unfinished runs or when distributing the parse step.
         job_dir = self.exp.path + "-grid-steps"
-        if os.path.exists(job_dir):
+        if any(is_resubmit_step(step) for step in steps):
+            # Live tasks may still execute the runs that we would reset.
+            active_jobs = monitor.get_active_jobs(job_dir)
+            if active_jobs:
+                logging.critical(
+                    f"Jobs of the experiment are still pending or running: "
+                    f"{', '.join(active_jobs)}. Wait for them to finish or "
+                    f"cancel them with scancel before resubmitting runs."
+                )
+        if os.path.exists(job_dir) and any(is_run_step(step) for step in steps):
             tools.confirm_or_abort(
                 f'The path "{job_dir}" already exists, so the experiment has '
                 f"already been submitted. Are you sure you want to "
@@ -398,15 +983,69 @@ class SlurmEnvironment(Environment):
         # Create job dir only when we need it.
         tools.makedirs(job_dir)
 
-        prev_job_id = None
+        # Each job waits for all jobs of the previous stage.
+        prev_job_ids = []
+        for jobs in self._get_stages(steps):
+            job_ids = []
+            for job_name, job_content in jobs:
+                job_file = os.path.join(job_dir, job_name)
+                tools.write_file(job_file, job_content)
+                job_id = self._submit_job(
+                    job_name,
+                    job_file,
+                    job_dir,
+                    dependency=":".join(prev_job_ids) or None,
+                )
+                # Let the monitor find the jobs of the experiment.
+                monitor.write_job(job_dir, job_name, job_id)
+                job_ids.append(job_id)
+            prev_job_ids = job_ids
+
+    def _get_stages(self, steps):
+        """Return the jobs for the *steps* as a list of stages.
+
+        Each stage is a list of (job name, job content) pairs. The jobs
+        of a stage may run in parallel, but only after all jobs of the
+        previous stage have finished.
+
+        """
+        stages = []
+        # Consecutive steps that are executed by a single job.
+        combined_steps = []
+
+        def add_combined_job():
+            if combined_steps:
+                is_last = combined_steps[-1] == steps[-1]
+                stages.append([self._get_combined_job(combined_steps, is_last)])
+                combined_steps.clear()
+
         for step in steps:
-            job_name = self._get_job_name(step)
-            job_file = os.path.join(job_dir, job_name)
-            job_content = self._get_job(step, is_last=(step == steps[-1]))
-            tools.write_file(job_file, job_content)
-            prev_job_id = self._submit_job(
-                job_name, job_file, job_dir, dependency=prev_job_id
-            )
+            is_last = step == steps[-1]
+            if is_resubmit_step(step):
+                run_ids = executor.reset_unfinished_runs(
+                    self.exp.path, len(self.exp.runs), **step.kwargs
+                )
+                if not run_ids:
+                    logging.info("All runs finished --> nothing to resubmit")
+                    continue
+                new_stages = [self._get_run_jobs(step, is_last, run_ids)]
+            elif is_run_step(step):
+                new_stages = [self._get_run_jobs(step, is_last)]
+            elif is_parse_step(step) and self.parse_tasks > 1:
+                from lab.experiment import PARSE_PARTS_DIRNAME
+
+                # Parts of an earlier parse may use a different number of parts.
+                tools.remove_path(os.path.join(self.exp.path, PARSE_PARTS_DIRNAME))
+                new_stages = [[job] for job in self._get_parse_jobs(step, is_last)]
+            else:
+                combined_steps.append(step)
+                if not self.combine_steps:
+                    add_combined_job()
+                continue
+            add_combined_job()
+            stages.extend(new_stages)
+        add_combined_job()
+        return stages
 
     def _get_job_params(self, step, is_last):
         job_params = {
@@ -428,11 +1067,8 @@ class SlurmEnvironment(Environment):
         job_params["time_limit_per_task"] = self.time_limit_per_task
         job_params["memory_per_cpu"] = self.memory_per_cpu
         job_params["cpus_per_task"] = self.cpus_per_task
-        memory_per_cpu_kb = SlurmEnvironment._get_memory_in_kb(self.memory_per_cpu)
-        job_params["soft_memory_limit"] = int(
-            self.cpus_per_task * memory_per_cpu_kb * 0.98
-        )
-        job_params["nice"] = self.NICE_VALUE if is_run_step(step) else 0
+        job_params["soft_memory_limit"] = self._get_soft_memory_limit()
+        job_params["nice"] = self.NICE_VALUE if _is_run_job(step) else 0
         job_params["environment_setup"] = self.setup
 
         if is_last and self.email:
@@ -496,4 +1132,3 @@ class TetralithEnvironment(SlurmEnvironment):
     def is_present(cls):
         node = platform.node()
         return re.match(r"tetralith\d+\.nsc\.liu\.se|n\d+", node)
-
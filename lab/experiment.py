@@ -1,13 +1,16 @@
 """Main module for creating experiments."""
 
+import json
 import logging
 import os
 import re
 import sys
+import tempfile
 from collections import OrderedDict
 from pathlib import Path
 
 from lab import environments, tools
+from lab.calls import executor, shards
 from lab.fetcher import Fetcher
 from lab.parser import Parser
 from lab.steps import Step, get_step, get_steps_text
@@ -33,6 +36,13 @@ steps_group.add_argument(
 STATIC_EXPERIMENT_PROPERTIES_FILENAME = "static-experiment-properties"
 STATIC_RUN_PROPERTIES_FILENAME = "static-properties"
 
+#: Environment variable that restricts the parse step to a part of the
+#: runs ("3/10" selects the third of ten parts) or lets it merge the
+#: properties of all parts ("merge").
+PARSE_PART_VARIABLE = "LAB_PARSE_PART"
+#: Experiment subdirectory for the combined properties of each part.
+PARSE_PARTS_DIRNAME = "parse-parts"
+
 
 def get_default_data_dir():
     """E.g. "ham/spam/eggs.py" => "ham/spam/data/"."""
@@ -59,6 +69,19 @@ def get_run_dir(task_id):
     return f"runs-{lower:0>5}-{upper:0>5}/{task_id:0>5}"
 
 
+def get_runs_without_scripts(exp_path):
+    """Return (run_dir, static_properties) pairs of the experiment's runs.
+
+    Return an empty list if the experiment has been built with run
+    scripts and "static-properties" files.
+
+    """
+    run_specs = executor.RunSpecs(exp_path)
+    if not run_specs or "properties" not in run_specs.get(1):
+        return []
+    return [(spec["run_dir"], spec["properties"]) for spec in run_specs]
+
+
 def _check_name(name, typ, extra_chars=""):
     if not isinstance(name, str):
         logging.critical(f"Name for {typ} must be a string: {name}")
@@ -206,8 +229,20 @@ class _Buildable:
         command is the sum of time spent across all threads of the
         process.
 
+        Commands that don't use the CPU (e.g., because they wait for I/O)
+        are stopped by a wall-clock watchdog: if a command runs for more
+        than 1.5 * *time_limit* seconds (at least 30 seconds), SIGTERM is
+        sent to the command and all of its child processes, followed by
+        SIGKILL five seconds later. The driver.log file then records the
+        watchdog signal.
+
         The command is aborted with SIGKILL when it uses more than
-        *memory_limit* MiB.
+        *memory_limit* MiB. The
+        :py:class:`~lab.environments.LocalEnvironment` only starts a run
+        when enough memory is available for its command with the highest
+        *memory_limit*. You can override the memory (in MiB) and number
+        of cores that the environment reserves for a run by setting the
+        run properties "required_memory" and "required_cores".
 
         You can limit the log size (in KiB) with a soft and hard limit
         for both stdout and stderr. When the soft limit is hit, an
@@ -335,7 +370,7 @@ class Experiment(_Buildable):
 
     """
 
-    def __init__(self, path=None, environment=None):
+    def __init__(self, path=None, environment=None, run_scripts=True):
         """
         The experiment will be built at *path*. It defaults to
         ``<scriptdir>/data/<scriptname>/``. E.g., for the script
@@ -351,6 +386,18 @@ class Experiment(_Buildable):
         Alternatively, you can derive your own class from
         :ref:`Environment <environments>`.
 
+        The commands of all runs are stored in the compact
+        experiment-level file ``run-specs.jsonl``, which the environments
+        use for executing the runs. If *run_scripts* is True (default), each
+        run directory additionally gets a ``run`` script and a
+        ``static-properties`` file. For experiments with many runs, set
+        *run_scripts* to False to save build time and inodes. Then, the
+        static run properties are stored in ``run-specs.jsonl`` as well and
+        run directories are only created during the build if the run has
+        resources or new files. All other run directories are created when
+        the run starts. This requires that all command arguments can be
+        encoded as JSON.
+
         """
         tools.configure_logging()
 
@@ -361,6 +408,7 @@ class Experiment(_Buildable):
             logging.critical(f"Path contains commas or colons: {self.path}")
         self.environment = environment or environments.LocalEnvironment()
         self.environment.exp = self
+        self.run_scripts = run_scripts
 
         self.steps = []
         self.runs = []
@@ -444,17 +492,68 @@ class Experiment(_Buildable):
 
         After parsing, you'll want to run a "fetch" step to collect the parsed
         data from the experiment into the evaluation directory.
+
+        Runs that have been packed into shards (see
+        :py:class:`~lab.environments.SlurmEnvironment`) are extracted to a
+        temporary directory for parsing. Their properties are stored next
+        to the shard.
+
+        Slurm environments can split this step into multiple tasks (see
+        *parse_tasks* in :py:class:`~lab.environments.SlurmEnvironment`).
+        Then, each task only parses every n-th run directory and shard and
+        additionally writes the combined properties of its runs to the
+        directory ``parse-parts``. A final task merges them into the file
+        ``properties`` in the experiment directory, which the fetcher reads
+        instead of visiting all runs again.
         """
 
         if not os.path.isdir(self.path):
             logging.critical(f"{self.path} is missing or not a directory")
 
-        run_dirs = sorted(Path(self.path).glob("runs-*-*/*"))
-        num_runs = len(run_dirs)
+        part = os.environ.get(PARSE_PART_VARIABLE)
+        if part == "merge":
+            self._merge_parse_parts()
+            return
+
+        static_runs = get_runs_without_scripts(self.path)
+        run_shards = shards.get_run_shards(self.path)
+        runs = [
+            (run_dir, static_props)
+            for run_dir, static_props in static_runs
+            if run_dir not in run_shards
+        ] or [
+            (str(run_dir.relative_to(self.path)), None)
+            for run_dir in sorted(Path(self.path).glob("runs-*-*/*"))
+            if str(run_dir.relative_to(self.path)) not in run_shards
+        ]
+        # All tasks must see the shards in the same order.
+        unique_shards = sorted(
+            {shard.path: shard for shard in run_shards.values()}.values(),
+            key=lambda shard: shard.path,
+        )
+        if part:
+            part_index, num_parts = (int(number) for number in part.split("/"))
+            runs = runs[part_index - 1 :: num_parts]
+            unique_shards = unique_shards[part_index - 1 :: num_parts]
+        else:
+            # The merged properties of an earlier parallel parse are outdated.
+            tools.remove_path(Path(self.path) / "properties")
+            tools.remove_path(Path(self.path) / PARSE_PARTS_DIRNAME)
+        shard_runs = [
+            (run_dir, shard)
+            for shard in unique_shards
+            for run_dir in shard.run_dirs
+            if run_shards[run_dir] is shard
+        ]
+        num_runs = len(runs) + len(shard_runs)
         logging.info(
             f"Running {len(self.parsers)} parsers in {num_runs:d} run directories."
         )
-        for index, run_dir in enumerate(run_dirs, start=1):
+        index = 0
+
+        def parse_run(run_dir):
+            nonlocal index
+            index += 1
             props_path = run_dir / "properties"
             if props_path.is_file():
                 props_path.unlink()
@@ -464,7 +563,62 @@ class Experiment(_Buildable):
             props = tools.Properties(filename=props_path)
             for parser in self.parsers:
                 parser.parse(run_dir, props)
-            props.write()
+            return props
+
+        for run_dir, _ in runs:
+            parse_run(Path(self.path) / run_dir).write()
+
+        for shard in unique_shards:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                shard.extract(tmp_dir)
+                shard.write_properties(
+                    {
+                        run_dir: parse_run(Path(tmp_dir) / run_dir)
+                        for run_dir in shard.run_dirs
+                        if run_shards[run_dir] is shard
+                    }
+                )
+
+        if part:
+            # Combine the static and parsed properties like the fetcher.
+            fetcher = Fetcher()
+            static_props = dict(static_runs)
+            part_props = tools.Properties(
+                Path(self.path)
+                / PARSE_PARTS_DIRNAME
+                / f"part-{part_index:05d}-of-{num_parts:05d}.json"
+            )
+            for run_dir, _ in runs + shard_runs:
+                props = fetcher.fetch_run(
+                    self.path, run_dir, static_props.get(run_dir), run_shards
+                )
+                part_props["-".join(props["id"])] = props
+            part_props.write()
+
+    def _merge_parse_parts(self):
+        parts_dir = Path(self.path) / PARSE_PARTS_DIRNAME
+        part_paths = sorted(parts_dir.glob("part-*-of-*.json"))
+        if not part_paths:
+            logging.critical(f"No parsed properties found in {parts_dir}")
+        num_parts = int(part_paths[0].stem.split("-")[-1])
+        if len(part_paths) != num_parts:
+            logging.critical(
+                f"Only {len(part_paths)} of {num_parts} parts have been parsed."
+            )
+        try:
+            slurm_err_content = tools.get_slurm_err_content(self.path)
+        except FileNotFoundError:
+            slurm_err_content = ""
+        props_path = Path(self.path) / "properties"
+        tools.remove_path(props_path)
+        props = tools.Properties(props_path)
+        for part_path in part_paths:
+            props.update(tools.Properties(part_path))
+        if slurm_err_content:
+            for run_props in props.values():
+                tools.add_unexplained_error(run_props, "output-to-slurm.err")
+        props.write()
+        logging.info(f"Merged properties of {len(props)} runs from {num_parts} parts")
 
     def add_fetcher(
         self, src=None, dest=None, merge=None, name=None, filter=None, **kwargs
@@ -566,8 +720,17 @@ class Experiment(_Buildable):
             return
         # Run all steps if --all is passed.
         steps = [get_step(self.steps, name) for name in args.steps] or self.steps
-        # Use LocalEnvironment if the main experiment step is inactive.
-        if any(environments.is_run_step(step) for step in steps):
+        # Use LocalEnvironment if the main experiment step is inactive,
+        # unless the environment distributes the parse step (and we're not
+        # in one of its jobs already).
+        parse_tasks = getattr(self.environment, "parse_tasks", 1)
+        distribute_parsing = parse_tasks > 1 and PARSE_PART_VARIABLE not in os.environ
+        if any(
+            environments.is_run_step(step)
+            or environments.is_resubmit_step(step)
+            or (environments.is_parse_step(step) and distribute_parsing)
+            for step in steps
+        ):
             env = self.environment
         else:
             env = environments.LocalEnvironment()
@@ -613,6 +776,27 @@ class Experiment(_Buildable):
         """
         self.environment.start_runs()
 
+    def resubmit_runs(self, include_failed=False):
+        """Execute the runs again that didn't finish.
+
+        Use this step if runs never started or were killed, e.g., because
+        a node failed or Slurm preempted a task. It consults the journal
+        ``run-journal.jsonl``, in which the environments record started and
+        finished runs, and executes all runs again that have no "finished"
+        entry or no run directory. If *include_failed* is True, failed
+        runs are executed again as well.
+
+        With a Slurm environment, this step submits a new job array that
+        contains only these runs, and the following steps wait for it. ::
+
+            exp.add_step("resubmit", exp.resubmit_runs)
+
+        Then, e.g., ``./exp.py resubmit parse`` executes the remaining runs
+        and parses all runs afterwards.
+
+        """
+        self.environment.resubmit_runs(include_failed=include_failed)
+
     def _build_runs(self):
         """
         Uses the relative directory information and writes all runs to disc.
@@ -622,12 +806,23 @@ class Experiment(_Buildable):
         num_runs = len(self.runs)
         self.set_property("runs", num_runs)
         logging.info(f"Building {num_runs} runs")
+        num_fallback_runs = 0
+        specs = executor.RunSpecsWriter(self.path)
         for index, run in enumerate(self.runs, 1):
             if index % 100 == 0:
                 logging.info(f"Build run {index:6}/{num_runs}")
             for name, (command, kwargs) in self.commands.items():
                 run.add_command(name, command, **kwargs)
             run.build(index)
+            if run.spec["calls"] is None:
+                num_fallback_runs += 1
+            specs.add(run.spec)
+        specs.close()
+        if num_fallback_runs:
+            logging.info(
+                f"The commands of {num_fallback_runs} runs can't be stored as JSON, "
+                f"so these runs are executed with their run scripts."
+            )
         logging.info("Finished building runs")
 
 
@@ -646,6 +841,8 @@ class Run(_Buildable):
         _Buildable.__init__(self)
         self.experiment = experiment
         self.path = None
+        # Specification for executing the run without the run script.
+        self.spec = None
 
     def build(self, run_id):
         """Write the run's files to disk.
@@ -656,17 +853,57 @@ class Run(_Buildable):
         rel_run_dir = get_run_dir(run_id)
         self.set_property("run_dir", rel_run_dir)
         self.path = os.path.join(self.experiment.path, rel_run_dir)
-        os.makedirs(self.path)
+        calls = self._get_calls()
+        self._check_id()
+
+        # Let schedulers know how many resources the run needs.
+        memory_limits = [
+            kwargs["memory_limit"]
+            for _, kwargs in calls
+            if kwargs.get("memory_limit") is not None
+        ]
+        requirements = {
+            "cores": self.properties.get("required_cores", 1),
+            "memory": self.properties.get(
+                "required_memory", max(memory_limits, default=None)
+            ),
+        }
+
+        if self.experiment.run_scripts:
+            os.makedirs(self.path)
+            # We need to build the run script before the resources, because
+            # the run script is added as a resource.
+            self._build_run_script(calls)
+            self.spec = executor.get_run_spec(rel_run_dir, calls, **requirements)
+        else:
+            self.spec = executor.get_run_spec(
+                rel_run_dir,
+                calls,
+                properties=json.loads(str(self.properties)),
+                **requirements,
+            )
+            if self.spec["calls"] is None:
+                logging.critical(
+                    f"The commands of run {rel_run_dir} can't be encoded as JSON. "
+                    f"Please build the experiment with run_scripts=True."
+                )
+            if self.new_files or any(
+                self._get_abs_path(resource.dest).startswith(self.path)
+                for resource in self.resources
+            ):
+                os.makedirs(self.path)
 
-        # We need to build the run script before the resources, because
-        # the run script is added as a resource.
-        self._build_run_script()
         self._build_new_files()
         self._build_resources()
-        self._check_id()
-        self._build_properties_file(STATIC_RUN_PROPERTIES_FILENAME)
+        if self.experiment.run_scripts:
+            self._build_properties_file(STATIC_RUN_PROPERTIES_FILENAME)
+
+    def _get_calls(self):
+        """Return (args, kwargs) pairs for the Calls of this run.
 
-    def _build_run_script(self):
+        Resource aliases are already replaced by their paths.
+
+        """
         if not self.commands:
             logging.critical("Please add at least one command")
 
@@ -682,37 +919,42 @@ class Run(_Buildable):
         env_vars.update(run_vars)
         env_vars = self._prepare_env_vars(env_vars)
 
-        def make_call(name, cmd, kwargs):
-            kwargs["name"] = name
-
-            # Support running globally installed binaries.
-            def format_arg(arg):
-                if isinstance(arg, str):
-                    try:
-                        return repr(arg.format(**env_vars))
-                    except KeyError as err:
-                        logging.critical(f"Resource {err} is undefined.")
-                else:
-                    return repr(str(arg))
-
-            def format_key_value_pair(key, val):
-                formatted_value = format_arg(val) if isinstance(val, str) else repr(val)
-                return f"{key}={formatted_value}"
+        # Support running globally installed binaries.
+        def format_arg(arg):
+            if isinstance(arg, str):
+                try:
+                    return arg.format(**env_vars)
+                except KeyError as err:
+                    logging.critical(f"Resource {err} is undefined.")
+            else:
+                return str(arg)
+
+        calls = []
+        for name, (cmd, kwargs) in self.commands.items():
+            kwargs = dict(kwargs, name=name)
+            calls.append(
+                (
+                    [format_arg(arg) for arg in cmd],
+                    {
+                        key: format_arg(value) if isinstance(value, str) else value
+                        for key, value in sorted(kwargs.items())
+                    },
+                )
+            )
+        return calls
 
-            cmd_string = f"[{', '.join([format_arg(arg) for arg in cmd])}]"
+    def _build_run_script(self, calls):
+        def make_call(args, kwargs):
+            cmd_string = f"[{', '.join(repr(arg) for arg in args)}]"
             kwargs_string = ", ".join(
-                format_key_value_pair(key, value)
-                for key, value in sorted(kwargs.items())
+                f"{key}={value!r}" for key, value in kwargs.items()
             )
             parts = [cmd_string]
             if kwargs_string:
                 parts.append(kwargs_string)
-            return f"Call({', '.join(parts)}, **redirects).wait()\n"
+            return f"    Call({', '.join(parts)}, **redirects).wait()\n"
 
-        calls_text = "\n".join(
-            make_call(name, cmd, kwargs)
-            for name, (cmd, kwargs) in self.commands.items()
-        )
+        calls_text = "\n".join(make_call(args, kwargs) for args, kwargs in calls)
         run_script = tools.fill_template("run.py", calls=calls_text)
 
         self.add_new_file("", "run", run_script, permissions=0o755)
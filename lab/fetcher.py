@@ -1,9 +1,11 @@
+import json
 import logging
 import sys
 from pathlib import Path
 
 import lab.experiment
 from lab import tools
+from lab.calls import shards
 
 
 def _check_eval_dir(eval_dir: Path):
@@ -43,12 +45,17 @@ class Fetcher:
 
     """
 
-    def fetch_dir(self, run_dir):
-        """Combine "static-properties" and "properties" from a run dir and return it."""
+    def fetch_dir(self, run_dir, static_props=None):
+        """Combine "static-properties" and "properties" from a run dir and return it.
+
+        If given, use *static_props* instead of the "static-properties" file.
+
+        """
         run_dir = Path(run_dir)
-        static_props = tools.Properties(
-            filename=run_dir / lab.experiment.STATIC_RUN_PROPERTIES_FILENAME
-        )
+        if static_props is None:
+            static_props = tools.Properties(
+                filename=run_dir / lab.experiment.STATIC_RUN_PROPERTIES_FILENAME
+            )
         dynamic_props_path = run_dir / "properties"
         dynamic_props = tools.Properties(filename=dynamic_props_path)
         if not dynamic_props_path.exists():
@@ -62,23 +69,64 @@ class Fetcher:
                 f" empty. Have you added at least one parser?"
             )
 
+        def read_log(name):
+            path = run_dir / name
+            return path.read_text() if path.exists() else None
+
+        return self._combine_props(static_props, dynamic_props, read_log)
+
+    def fetch_shard_run(self, shard, run_dir, static_props=None):
+        """Return the combined properties of *run_dir* packed in *shard*."""
+        if static_props is None:
+            static_props = json.loads(
+                shard.read(f"{run_dir}/{lab.experiment.STATIC_RUN_PROPERTIES_FILENAME}")
+                or "{}"
+            )
+        shard_props = shard.get_properties()
+        if shard_props is None:
+            logging.critical(
+                f'Properties of shard "{tools.get_relative_path(shard.path)}" are'
+                f' missing. Did you forget to add or run the "parse" step?'
+            )
+        dynamic_props = shard_props.get(run_dir)
+        if not dynamic_props:
+            logging.critical(
+                f'Properties of run "{run_dir}" in shard '
+                f'"{tools.get_relative_path(shard.path)}" are missing or empty. '
+                f"Have you added at least one parser?"
+            )
+
+        def read_log(name):
+            return shard.read(f"{run_dir}/{name}")
+
+        return self._combine_props(static_props, dynamic_props, read_log)
+
+    def fetch_run(self, src_dir, run_dir, static_props=None, run_shards=None):
+        """Return the combined properties of *run_dir* relative to *src_dir*.
+
+        If *run_shards* (see :func:`lab.calls.shards.get_run_shards`)
+        contains *run_dir*, read the run from its shard.
+
+        """
+        if run_shards and run_dir in run_shards:
+            return self.fetch_shard_run(run_shards[run_dir], run_dir, static_props)
+        return self.fetch_dir(Path(src_dir) / run_dir, static_props)
+
+    @staticmethod
+    def _combine_props(static_props, dynamic_props, read_log):
         props = tools.Properties()
         props.update(static_props)
         props.update(dynamic_props)
 
-        driver_log = run_dir / "driver.log"
-        if not driver_log.exists():
+        if read_log("driver.log") is None:
             props.add_unexplained_error(
                 "driver.log is missing. Probably the run was never started."
             )
 
-        driver_err = run_dir / "driver.err"
-        run_err = run_dir / "run.err"
-        for logfile in [driver_err, run_err]:
-            if logfile.exists():
-                content = logfile.read_text()
-                if content:
-                    props.add_unexplained_error(f"{logfile.name}: {content}")
+        for logfile in ["driver.err", "run.err"]:
+            content = read_log(logfile)
+            if content:
+                props.add_unexplained_error(f"{logfile}: {content}")
         return props
 
     def __call__(self, src_dir, eval_dir=None, merge=None, filter=None, **kwargs):
@@ -136,11 +184,22 @@ class Fetcher:
                 logging.warning("There was output to *-grid-steps/slurm.err")
 
             new_props = tools.Properties()
-            run_dirs = sorted(src_dir.glob("runs-*-*/*"))
-            num_dirs = len(run_dirs)
+            run_shards = shards.get_run_shards(src_dir)
+            runs = lab.experiment.get_runs_without_scripts(src_dir) or [
+                (str(run_dir.relative_to(src_dir)), None)
+                for run_dir in sorted(src_dir.glob("runs-*-*/*"))
+            ]
+            # Add packed runs that have no run dir anymore.
+            listed_run_dirs = {run_dir for run_dir, _ in runs}
+            runs += [
+                (run_dir, None)
+                for run_dir in sorted(run_shards)
+                if run_dir not in listed_run_dirs
+            ]
+            num_dirs = len(runs)
             logging.info(f"Collecting properties from {num_dirs:d} run directories")
-            for index, run_dir in enumerate(run_dirs, start=1):
-                props = self.fetch_dir(run_dir)
+            for index, (run_dir, static_props) in enumerate(runs, start=1):
+                props = self.fetch_run(src_dir, run_dir, static_props, run_shards)
                 if slurm_err_content:
                     props.add_unexplained_error("output-to-slurm.err")
                 id_string = "-".join(props["id"])
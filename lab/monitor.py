@@ -0,0 +1,281 @@
+"""Report the progress of experiments that have been submitted to Slurm.
+
+:py:class:`~lab.environments.SlurmEnvironment` stores the IDs of the
+submitted jobs in the file :data:`JOBS_FILENAME` of the ``-grid-steps``
+directory. This module queries Slurm for the state of the array tasks of
+these jobs (with ``sacct`` or, if job accounting is unavailable, with
+``squeue``) and combines it with the run journal of the experiment. Add a
+step for it to the experiment and execute it on the login node::
+
+    from lab import monitor
+
+    exp.add_step("status", monitor.print_status, exp.path)
+
+"""
+
+import datetime
+import getpass
+import json
+import logging
+import os
+import statistics
+import subprocess
+import time
+from collections import Counter
+
+from lab.calls import executor
+from lab.calls.scheduler import parse_cpu_list
+
+#: Name of the file in the job directory that maps job names to job IDs.
+JOBS_FILENAME = "jobs.json"
+
+#: Fields that we request from ``sacct``.
+SACCT_FIELDS = ["JobID", "JobName", "State", "Submit", "Start"]
+#: Output format for ``squeue`` with the same fields as :data:`SACCT_FIELDS`.
+SQUEUE_FORMAT = "%i|%j|%T|%V|%S"
+
+#: Map from Slurm job states to the categories that we report. All other
+#: states (e.g., FAILED, TIMEOUT and NODE_FAIL) count as failed.
+STATE_CATEGORIES = {
+    "PENDING": "pending",
+    "REQUEUED": "pending",
+    "CONFIGURING": "running",
+    "RUNNING": "running",
+    "COMPLETING": "running",
+    "COMPLETED": "completed",
+}
+
+
+def get_job_dir(exp_path):
+    return str(exp_path).rstrip("/") + "-grid-steps"
+
+
+def read_jobs(job_dir):
+    """Return a dict that maps the names of the submitted jobs to their IDs."""
+    path = os.path.join(job_dir, JOBS_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_job(job_dir, job_name, job_id):
+    """Add a submitted job to the jobs file in *job_dir*."""
+    jobs = read_jobs(job_dir)
+    jobs[job_name] = job_id
+    with open(os.path.join(job_dir, JOBS_FILENAME), "w") as f:
+        json.dump(jobs, f, indent=2)
+
+
+def query_slurm(job_ids):
+    """Return the table of array tasks of the given jobs from Slurm.
+
+    Use ``sacct`` and fall back to ``squeue``, which only knows about
+    pending and running tasks.
+
+    """
+    job_list = ",".join(job_ids)
+    sacct = [
+        "sacct",
+        "--allocations",
+        "--array",
+        "--noheader",
+        "--parsable2",
+        f"--format={','.join(SACCT_FIELDS)}",
+        f"--jobs={job_list}",
+    ]
+    squeue = ["squeue", "--array", "--noheader", "--jobs", job_list]
+    squeue.append(f"--format={SQUEUE_FORMAT}")
+    for cmd in [sacct, squeue]:
+        try:
+            return subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode()
+        except (OSError, subprocess.CalledProcessError) as err:
+            logging.warning(f"Querying Slurm with {cmd[0]} failed: {err}")
+    return ""
+
+
+def query_active_job_ids():
+    """Return the IDs of the pending and running jobs of the current user.
+
+    We don't pass the job IDs to ``squeue``, since it fails for jobs that
+    Slurm has already forgotten.
+
+    """
+    cmd = ["squeue", "--noheader", "--user", getpass.getuser(), "--format=%F"]
+    try:
+        output = subprocess.check_output(cmd, stderr=subprocess.DEVNULL).decode()
+    except (OSError, subprocess.CalledProcessError) as err:
+        logging.warning(f"Querying Slurm with squeue failed: {err}")
+        return set()
+    # Array jobs are listed with the ID of the whole array.
+    return set(output.split())
+
+
+def get_active_jobs(job_dir, query=query_active_job_ids):
+    """Return the names of the submitted jobs that are pending or running."""
+    jobs = read_jobs(job_dir)
+    if not jobs:
+        return []
+    active_job_ids = query()
+    return [name for name, job_id in jobs.items() if job_id in active_job_ids]
+
+
+def _parse_time(text):
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        # Slurm uses "Unknown", "None" and "N/A" for missing times.
+        return None
+
+
+def parse_job_table(text):
+    """Parse the output of :func:`query_slurm`.
+
+    Return a list of dicts with the keys "job", "task", "name", "state"
+    (e.g., "COMPLETED"), "submit" and "start" (datetimes or None).
+
+    >>> table = "12_1|exp-02-run|CANCELLED by 7|2026-10-19T10:00:00|Unknown\\n"
+    >>> table += "12_[2-3%1]|exp-02-run|PENDING|2026-10-19T10:00:00|Unknown"
+    >>> tasks = parse_job_table(table)
+    >>> [(task["job"], task["task"], task["state"]) for task in tasks]
+    [('12', '1', 'CANCELLED'), ('12', '2', 'PENDING'), ('12', '3', 'PENDING')]
+    """
+    tasks = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        job_id, name, state, submit, start = line.split("|")[: len(SACCT_FIELDS)]
+        job, _, task = job_id.partition("_")
+        if task.startswith("["):
+            # Pending tasks may be listed as a range, e.g., "[5-100%10]".
+            task_ids = [
+                str(task_id)
+                for task_id in parse_cpu_list(task.strip("[]").partition("%")[0])
+            ]
+        else:
+            task_ids = [task]
+        for task_id in task_ids:
+            tasks.append(
+                {
+                    "job": job,
+                    "task": task_id,
+                    "name": name,
+                    "state": state.split()[0] if state.strip() else "UNKNOWN",
+                    "submit": _parse_time(submit),
+                    "start": _parse_time(start),
+                }
+            )
+    return tasks
+
+
+def summarize_tasks(tasks, now=None):
+    """Count the tasks of a job by category and compute their queue wait times.
+
+    The wait time of a task is the time between submitting and starting it
+    or, for pending tasks, between submitting it and *now*.
+
+    """
+    now = now or datetime.datetime.now()
+    counts = Counter()
+    waits = []
+    for task in tasks:
+        category = STATE_CATEGORIES.get(task["state"], "failed")
+        counts[category] += 1
+        # For pending tasks, squeue reports the expected start time.
+        start = now if category == "pending" else task["start"]
+        if task["submit"] is not None and start is not None:
+            waits.append((start - task["submit"]).total_seconds())
+    return {
+        "tasks": len(tasks),
+        "pending": counts["pending"],
+        "running": counts["running"],
+        "completed": counts["completed"],
+        "failed": counts["failed"],
+        "median_wait": statistics.median(waits) if waits else None,
+        "max_wait": max(waits) if waits else None,
+    }
+
+
+def get_run_progress(exp_path, num_runs, now=None):
+    """Summarize the run journal of the experiment.
+
+    The throughput is the number of finished runs per second since the
+    first run started. The estimated remaining time assumes that the
+    throughput stays constant.
+
+    """
+    now = now or time.time()
+    journal = executor.RunJournal(exp_path)
+    all_entries = journal.get_entries()
+    entries = {entry["run"]: entry for entry in all_entries}.values()
+    finished = [entry for entry in entries if entry["state"] == "finished"]
+    running = sum(entry["state"] == "started" for entry in entries)
+    first_start = min(
+        (entry["time"] for entry in all_entries if entry["state"] == "started"),
+        default=None,
+    )
+    elapsed = now - first_start if first_start is not None else 0
+    runs_per_second = len(finished) / elapsed if elapsed > 0 else 0.0
+    remaining = num_runs - len(finished)
+    return {
+        "runs": num_runs,
+        "finished": len(finished),
+        "failed": sum(bool(entry.get("error")) for entry in finished),
+        "running": running,
+        "runs_per_second": runs_per_second,
+        "eta": remaining / runs_per_second if runs_per_second else None,
+    }
+
+
+def _format_seconds(seconds):
+    if seconds is None:
+        return "unknown"
+    return str(datetime.timedelta(seconds=round(seconds)))
+
+
+def get_status_lines(exp_path, query=query_slurm):
+    """Return the progress report of the experiment as a list of lines.
+
+    *query* is called with the list of job IDs and must return a table in
+    the format of :func:`query_slurm`. Tests can pass a stand-in for Slurm.
+
+    """
+    jobs = read_jobs(get_job_dir(exp_path))
+    lines = []
+    tasks = parse_job_table(query(list(jobs.values()))) if jobs else []
+    for job_name, job_id in jobs.items():
+        summary = summarize_tasks([task for task in tasks if task["job"] == job_id])
+        if not summary["tasks"]:
+            lines.append(f"{job_name} (job {job_id}): unknown to Slurm")
+            continue
+        lines.append(
+            f"{job_name} (job {job_id}): {summary['tasks']} tasks, "
+            f"{summary['pending']} pending, {summary['running']} running, "
+            f"{summary['completed']} completed, {summary['failed']} failed, "
+            f"queue wait: median {_format_seconds(summary['median_wait'])}, "
+            f"max {_format_seconds(summary['max_wait'])}"
+        )
+
+    num_runs = len(executor.RunSpecs(exp_path))
+    if num_runs:
+        progress = get_run_progress(exp_path, num_runs)
+        eta = progress["eta"]
+        completion = "unknown"
+        if eta is not None:
+            completion = datetime.datetime.now() + datetime.timedelta(seconds=eta)
+            completion = completion.isoformat(sep=" ", timespec="minutes")
+        lines.append(
+            f"Runs: {progress['finished']}/{progress['runs']} finished "
+            f"({progress['failed']} failed), {progress['running']} running, "
+            f"{progress['runs_per_second'] * 3600:.1f} runs/h, "
+            f"ETA: {_format_seconds(eta)} (at {completion})"
+        )
+    return lines
+
+
+def print_status(exp_path):
+    """Print the state of the Slurm jobs and the runs of the experiment."""
+    if not read_jobs(get_job_dir(exp_path)):
+        logging.warning(f"No submitted jobs found for {exp_path}")
+    for line in get_status_lines(exp_path):
+        print(line)
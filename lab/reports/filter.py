@@ -25,3 +25,36 @@ class FilterReport(Report):
 
     def get_text(self):
         return str(self.props)
+
+
+class NormalizeTimes:
+    """Report filter that makes times measured on different nodes comparable.
+
+    Multiply the values of the given time *attributes* by the speed factor
+    of the node that executed the run (the *speed_attribute*, see
+    *calibrate_nodes* in :py:class:`~lab.environments.Environment`). The
+    results estimate the times on the reference machine. Runs without a
+    speed factor stay unchanged. If *suffix* is given, store the normalized
+    times in new attributes instead of replacing the measured times.
+
+    >>> from downward.reports.absolute import AbsoluteReport
+    >>> normalize = NormalizeTimes(["search_time", "total_time"])
+    >>> normalize({"search_time": 10.0, "node_speed": 1.5})
+    {'search_time': 15.0, 'node_speed': 1.5}
+    >>> report = AbsoluteReport(attributes=["search_time"], filter=[normalize])
+
+    """
+
+    def __init__(self, attributes, speed_attribute="node_speed", suffix=""):
+        self.attributes = attributes
+        self.speed_attribute = speed_attribute
+        self.suffix = suffix
+
+    def __call__(self, run):
+        speed = run.get(self.speed_attribute)
+        if speed:
+            for attribute in self.attributes:
+                value = run.get(attribute)
+                if value is not None:
+                    run[attribute + self.suffix] = value * speed
+        return run
@@ -1,18 +1,20 @@
 import argparse
-import colorsys
 import contextlib
 import functools
 import logging
-import lzma
 import math
 import os
-import pkgutil
 import re
 import shutil
-import subprocess
 import sys
 from pathlib import Path
 
+# Keep the functions available here for backwards compatibility.
+from lab.calls.runtime import configure_logging, get_python_executable  # noqa: F401
+
+# We import rarely needed modules (colorsys, lzma, pkgutil, subprocess) in
+# the functions that use them to keep "import lab.tools" fast.
+
 # Use simplejson where it's available, because it is compatible (just separately
 # maintained), puts no blanks at line endings and loads json much faster:
 # json_dump: 44.41s, simplejson_dump: 45.90s
@@ -64,51 +66,6 @@ def get_relative_path(dest):
         return dest
 
 
-def get_python_executable():
-    return sys.executable or "python"
-
-
-def configure_logging(level=logging.INFO):
-    # Python adds a default handler if some log is written before this
-    # function is called. We therefore remove all handlers that have
-    # been added automatically.
-    root_logger = logging.getLogger("")
-    for handler in root_logger.handlers:
-        root_logger.removeHandler(handler)
-
-    class ErrorAbortHandler(logging.StreamHandler):
-        """
-        Logging handler that exits when a critical error is encountered.
-        """
-
-        def emit(self, record):
-            logging.StreamHandler.emit(self, record)
-            if record.levelno >= logging.CRITICAL:
-                sys.exit("aborting")
-
-    class StdoutFilter(logging.Filter):
-        def filter(self, record):
-            return record.levelno <= logging.WARNING
-
-    class StderrFilter(logging.Filter):
-        def filter(self, record):
-            return record.levelno > logging.WARNING
-
-    formatter = logging.Formatter("%(asctime)-s %(levelname)-8s %(message)s")
-
-    stdout_handler = logging.StreamHandler(sys.stdout)
-    stdout_handler.setFormatter(formatter)
-    stdout_handler.addFilter(StdoutFilter())
-
-    stderr_handler = ErrorAbortHandler(sys.stderr)
-    stderr_handler.setFormatter(formatter)
-    stderr_handler.addFilter(StderrFilter())
-
-    root_logger.addHandler(stdout_handler)
-    root_logger.addHandler(stderr_handler)
-    root_logger.setLevel(level)
-
-
 def show_deprecation_warning(msg):
     logging.warning(msg)
 
@@ -179,6 +136,8 @@ def write_file(filename, content):
 
 
 def fill_template(template_name, **parameters):
+    import pkgutil
+
     template = get_string(
         pkgutil.get_data("lab", os.path.join("data", template_name + ".template"))
     )
@@ -228,6 +187,8 @@ def find_file(filenames, dir="."):
 
 def run_command(cmd, **kwargs):
     """Run command cmd and return the output."""
+    import subprocess
+
     logging.info(f"Executing {' '.join(cmd)} {kwargs}")
     return subprocess.call(cmd, **kwargs)
 
@@ -292,6 +253,8 @@ class Properties(dict):
         return json.dumps(self, **self.JSON_ARGS)
 
     def load(self, filename):
+        import lzma
+
         path = Path(filename)
         open_func = lzma.open if path.suffix == ".xz" else open
         with open_func(path) as f:
@@ -305,6 +268,8 @@ class Properties(dict):
 
     def write(self):
         """Write the properties to disk."""
+        import lzma
+
         assert self.path
         self.path.parent.mkdir(parents=True, exist_ok=True)
         open_func = lzma.open if self.path.suffix == ".xz" else open
@@ -440,6 +405,8 @@ def copy(src, dest, ignores=None):
 
 
 def get_color(fraction, min_wins):
+    import colorsys
+
     assert 0 <= fraction <= 1, fraction
     if min_wins:
         fraction = 1 - fraction
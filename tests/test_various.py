@@ -1,7 +1,23 @@
 import datetime
+import json
 import os
+import re
+import signal
+import subprocess
+import sys
+import tarfile
+import time
+import types
 
-from lab import tools
+import pytest
+
+from lab import environments, monitor, tools
+from lab.calls import call, executor, runtime, scheduler, shards
+from lab.calls.call import Call
+from lab.compress_step import CompressStep
+from lab.experiment import PARSE_PART_VARIABLE, Experiment
+from lab.fetcher import Fetcher
+from lab.parser import Parser
 
 base = os.path.join("/tmp", str(datetime.datetime.now()))
 os.mkdir(base)
@@ -59,3 +75,485 @@ def test_colors():
     assert tools.get_colors(row, True) == expected_min_wins
     assert tools.get_colors(row, False) == expected_max_wins
     assert tools.rgb_fractions_to_html_color(1, 0, 0.5) == "rgb(255,0,127)"
+
+
+def test_call_timing():
+    call = Call(["true"], "true")
+    assert call.wall_clock_time is None
+    assert call.wait() == 0
+    assert 0 <= call.spawn_time <= call.wall_clock_time
+    assert call.teardown_time >= 0
+
+
+def test_call_limits():
+    outfile = os.path.join(base, "limits.txt")
+    call = Call(
+        ["sh", "-c", "ulimit -t; ulimit -c"], "limits", time_limit=10, stdout=outfile
+    )
+    assert call.wait() == 0
+    with open(outfile) as f:
+        assert f.read().split() == ["10", "0"]
+
+
+def test_process_run_in_process():
+    run_dir = os.path.join(base, "run")
+    os.mkdir(run_dir)
+    spec = executor.get_run_spec(
+        run_dir, [(["echo", "hello"], {"name": "greet", "time_limit": 10})]
+    )
+    assert not executor.process_run(run_dir, spec)
+    with open(os.path.join(run_dir, "run.log")) as f:
+        assert f.read() == "hello\n"
+    with open(os.path.join(run_dir, "driver.log")) as f:
+        assert "greet exit code: 0" in f.read()
+    assert not os.path.exists(os.path.join(run_dir, "driver.err"))
+
+
+def test_run_specs():
+    exp_dir = os.path.join(base, "exp")
+    os.mkdir(exp_dir)
+    writer = executor.RunSpecsWriter(exp_dir)
+    for run_id in range(1, 4):
+        writer.add(executor.get_run_spec(f"run{run_id}", [], {"id": [str(run_id)]}))
+    writer.close()
+    run_specs = executor.RunSpecs(exp_dir)
+    assert len(run_specs) == 3
+    assert run_specs.get(2)["properties"] == {"id": ["2"]}
+    assert run_specs.get(4) is None
+    assert [spec["run_dir"] for spec in run_specs] == ["run1", "run2", "run3"]
+
+
+def square(task_id):
+    return task_id**2
+
+
+def test_run_tasks_with_budget(tmp_path):
+    tasks = [
+        scheduler.Task(1, cores=1, memory=600),
+        scheduler.Task(2, cores=2, memory=600),
+        scheduler.Task(3, cores=1, memory=5000),
+        scheduler.Task(4, cores=1, memory=None),
+    ]
+    progress_file = tmp_path / "progress.json"
+    results = scheduler.run_tasks(
+        square, tasks, processes=2, memory_budget=1000, progress_file=progress_file
+    )
+    assert results == [1, 4, 9, 16]
+    progress = json.loads(progress_file.read_text())
+    assert progress["completed"] == progress["total"] == progress["failed"] == 4
+    assert progress["running"] == progress["pending"] == 0
+
+
+def test_run_tasks_in_batches():
+    tasks = [scheduler.Task(task_id, cores=1, memory=None) for task_id in range(100)]
+    results = scheduler.run_tasks(square, tasks, processes=2, batch_time=1)
+    assert results == [task_id**2 for task_id in range(100)]
+
+
+def interrupt_parent(task_id):
+    os.kill(os.getppid(), signal.SIGINT)
+    time.sleep(60)
+
+
+def test_run_tasks_reraises_interrupt():
+    tasks = [scheduler.Task(task_id, cores=1, memory=None) for task_id in range(2)]
+    with pytest.raises(KeyboardInterrupt):
+        scheduler.run_tasks(interrupt_parent, tasks, processes=1)
+
+
+def has_default_sigterm_handler(task_id):
+    return signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+
+
+def test_run_tasks_resets_sigterm_handler():
+    tasks = [scheduler.Task(task_id, cores=1, memory=None) for task_id in range(2)]
+    old_handler = signal.signal(signal.SIGTERM, lambda _signum, _frame: None)
+    try:
+        assert scheduler.run_tasks(has_default_sigterm_handler, tasks, processes=2) == [
+            True,
+            True,
+        ]
+    finally:
+        signal.signal(signal.SIGTERM, old_handler)
+
+
+def get_affinity(task_id):
+    return sorted(os.sched_getaffinity(0))
+
+
+def test_run_tasks_pinned():
+    cpu = min(os.sched_getaffinity(0))
+    tasks = [scheduler.Task(task_id, cores=1, memory=None) for task_id in range(3)]
+    results = scheduler.run_tasks(get_affinity, tasks, processes=1, cpu_nodes={cpu: 0})
+    assert results == [[cpu]] * 3
+
+
+def test_take_cpus_prefers_single_numa_node():
+    budget = scheduler._Budget(4, 1000, cpu_nodes={0: 0, 1: 0, 2: 1, 3: 1})
+    assert sorted(budget.acquire((1, 0))) == [0]
+    assert sorted(budget.acquire((2, 0))) == [2, 3]
+    assert sorted(budget.acquire((1, 0))) == [1]
+
+
+def test_run_journal(tmp_path):
+    journal = executor.RunJournal(tmp_path)
+    journal.add(1, "started")
+    journal.add(1, "finished", error=False)
+    journal.add(2, "started")
+    with open(journal.path, "ab") as f:
+        f.write(b'{"run": 3, "sta')
+    content = (tmp_path / executor.RUN_JOURNAL_FILENAME).read_bytes()
+    assert {
+        run_id: entry["state"] for run_id, entry in journal.get_states().items()
+    } == {
+        1: "finished",
+        2: "started",
+    }
+    # Readers leave entries that are still being written alone.
+    assert (tmp_path / executor.RUN_JOURNAL_FILENAME).read_bytes() == content
+    journal.add(3, "started")
+    assert journal.get_states()[3]["state"] == "started"
+
+
+def test_reset_unfinished_runs(tmp_path):
+    journal = executor.RunJournal(tmp_path)
+    for run_id in range(1, 6):
+        run_dir = tmp_path / "runs-00001-00100" / f"{run_id:05d}"
+        run_dir.mkdir(parents=True)
+        (run_dir / "driver.log").write_text("log")
+        journal.add(run_id, "started")
+    journal.add(1, "finished", error=False)
+    journal.add(3, "finished", error=True)
+    journal.add(4, "finished", error=False)
+    # Run 2 was killed, run 4 was lost and run 5 never finished.
+    (tmp_path / "runs-00001-00100" / "00004" / "driver.log").unlink()
+    assert executor.reset_unfinished_runs(tmp_path, 6) == [2, 4, 5, 6]
+    assert not (tmp_path / "runs-00001-00100" / "00002" / "driver.log").exists()
+    assert journal.get_states()[2]["state"] == "reset"
+    assert executor.reset_unfinished_runs(tmp_path, 6, include_failed=True) == [
+        2,
+        3,
+        4,
+        5,
+        6,
+    ]
+
+
+def test_monitor_status(tmp_path):
+    exp_path = tmp_path / "exp"
+    exp_path.mkdir()
+    writer = executor.RunSpecsWriter(exp_path)
+    for run_id in range(1, 5):
+        writer.add(executor.get_run_spec(f"runs-00001-00100/{run_id:05d}", []))
+    writer.close()
+    journal = executor.RunJournal(exp_path)
+    for run_id in [1, 2, 3]:
+        journal.add(run_id, "started")
+    journal.add(1, "finished", error=False)
+    journal.add(2, "finished", error=True)
+    job_dir = monitor.get_job_dir(exp_path)
+    os.mkdir(job_dir)
+    monitor.write_job(job_dir, "exp-02-run", "12")
+    monitor.write_job(job_dir, "exp-03-fetch", "13")
+
+    def query(job_ids):
+        assert job_ids == ["12", "13"]
+        return (
+            "12_1|exp-02-run|COMPLETED|2026-10-19T10:00:00|2026-10-19T10:10:00\n"
+            "12_2|exp-02-run|RUNNING|2026-10-19T10:00:00|2026-10-19T10:30:00\n"
+            "13_1|exp-03-fetch|PENDING|2026-10-19T10:00:00|Unknown\n"
+        )
+
+    lines = monitor.get_status_lines(exp_path, query=query)
+    assert lines[0].startswith(
+        "exp-02-run (job 12): 2 tasks, 0 pending, 1 running, 1 completed, 0 failed, "
+        "queue wait: median 0:20:00, max 0:30:00"
+    )
+    assert lines[1].startswith("exp-03-fetch (job 13): 1 tasks, 1 pending")
+    assert lines[2].startswith("Runs: 2/4 finished (1 failed), 1 running")
+    assert monitor.get_active_jobs(job_dir, query=lambda: {"11", "13"}) == [
+        "exp-03-fetch"
+    ]
+
+
+def test_call_watchdog(tmp_path, monkeypatch):
+    monkeypatch.setattr(call, "MIN_WALL_CLOCK_TIME_LIMIT", 0)
+    monkeypatch.setattr(call, "WATCHDOG_GRACE_PERIOD", 0.2)
+    # The shell ignores SIGTERM, so the watchdog has to escalate to SIGKILL.
+    stubborn = Call(
+        ["bash", "-c", "trap '' TERM; sleep 60 & wait"],
+        name="stubborn",
+        time_limit=1,
+        stdout=str(tmp_path / "out"),
+    )
+    assert stubborn.wait() == -signal.SIGKILL
+    assert stubborn.watchdog_signal == "SIGKILL"
+    assert stubborn.wall_clock_time < 5
+
+    polite = Call(["sleep", "60"], name="polite", time_limit=1)
+    assert polite.wait() == -signal.SIGTERM
+    assert polite.watchdog_signal == "SIGTERM"
+
+
+def test_fsync_policy(tmp_path, monkeypatch):
+    monkeypatch.setenv(runtime.FSYNC_VARIABLE, "never")
+    assert Call(["true"], name="true", stdout=str(tmp_path / "out")).wait() == 0
+    monkeypatch.setenv(runtime.FSYNC_VARIABLE, "task")
+    run_dir = tmp_path / "runs-00001-00100" / "00001"
+    run_dir.mkdir(parents=True)
+    (run_dir / "run.log").write_text("log")
+    (run_dir / "link").symlink_to("/nonexistent")
+    runtime.sync_after_task([run_dir, tmp_path / "packed"])
+    monkeypatch.setenv(runtime.FSYNC_VARIABLE, "sometimes")
+    with pytest.raises(SystemExit):
+        runtime.get_fsync_policy()
+
+
+def test_calibrate_node(monkeypatch):
+    monkeypatch.setattr(runtime, "BENCHMARK_ITERATIONS", 1000)
+    monkeypatch.delenv(runtime.NODE_SPEED_VARIABLE, raising=False)
+    runtime.calibrate_node()
+    speed = os.environ[runtime.NODE_SPEED_VARIABLE]
+    assert float(speed) > 0
+    # Later calls in the same task reuse the measured speed.
+    runtime.calibrate_node()
+    assert os.environ[runtime.NODE_SPEED_VARIABLE] == speed
+
+
+def test_stage_in_and_out(tmp_path):
+    exp_path = tmp_path / "exp"
+    run_dir = exp_path / "runs-00001-00100" / "00001"
+    run_dir.mkdir(parents=True)
+    (exp_path / "code").mkdir()
+    (exp_path / "code" / "solver").write_text("solve")
+    (run_dir / "solver").symlink_to("../../code/solver")
+    # Resources outside of the experiment dir, e.g., benchmarks.
+    (tmp_path / "benchmarks").mkdir()
+    (tmp_path / "benchmarks" / "task.pddl").write_text("task")
+    (run_dir / "task.pddl").symlink_to("../../../benchmarks/task.pddl")
+    rel_run_dirs = ["runs-00001-00100/00001"]
+
+    scratch_exp_path = executor.stage_in(exp_path, rel_run_dirs, tmp_path / "scratch")
+    scratch_run_dir = os.path.join(scratch_exp_path, rel_run_dirs[0])
+    with open(os.path.join(scratch_run_dir, "solver")) as f:
+        assert f.read() == "solve"
+    with open(os.path.join(scratch_run_dir, "task.pddl")) as f:
+        assert f.read() == "task"
+    with open(os.path.join(scratch_run_dir, "run.log"), "w") as f:
+        f.write("solved")
+
+    executor.stage_out(scratch_exp_path, rel_run_dirs, exp_path)
+    assert (run_dir / "run.log").read_text() == "solved"
+    assert os.readlink(run_dir / "solver") == "../../code/solver"
+    assert os.readlink(run_dir / "task.pddl") == "../../../benchmarks/task.pddl"
+    assert not os.path.exists(scratch_exp_path)
+
+
+def test_pack_runs(tmp_path):
+    for run_id in [1, 2]:
+        run_dir = tmp_path / "runs-00001-00100" / f"0000{run_id}"
+        run_dir.mkdir(parents=True)
+        (run_dir / "driver.log").write_text(f"run {run_id}")
+    rel_run_dirs = ["runs-00001-00100/00002", "runs-00001-00100/00001"]
+    shard_path = shards.pack_runs(tmp_path, rel_run_dirs, tmp_path / "run-shards")
+    assert os.path.basename(shard_path) == "runs-00001-00002.tar"
+
+    run_shards = shards.get_run_shards(tmp_path)
+    assert sorted(run_shards) == sorted(rel_run_dirs)
+    shard = run_shards["runs-00001-00100/00002"]
+    assert shard.read("runs-00001-00100/00002/driver.log") == "run 2"
+    assert shard.read("runs-00001-00100/00002/run.err") is None
+    assert shard.get_properties() is None
+
+
+def test_run_queue(tmp_path):
+    queues = [executor.RunQueue(tmp_path, 5, seed=3) for _ in range(2)]
+    claimed = [queues[i % 2].claim() for i in range(6)]
+    assert claimed[-1] is None
+    assert sorted(claimed[:-1]) == [1, 2, 3, 4, 5]
+    # A new submission uses a new queue.
+    queue = executor.RunQueue(tmp_path, 5, seed=4, shuffle=False)
+    assert [queue.claim() for _ in range(6)] == [1, 2, 3, 4, 5, None]
+
+
+def test_compress_step_threads(monkeypatch):
+    exp = types.SimpleNamespace(path="exp", name="exp")
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: {0, 2, 5})
+    assert CompressStep(exp, "archive").threads == 3
+    assert CompressStep(exp, "archive", threads=8).threads == 8
+
+
+@pytest.mark.parametrize("compression", ["gz", "xz"])
+def test_compress_step(tmp_path, monkeypatch, compression):
+    exp_path = tmp_path / "exp"
+    run_dir = exp_path / "runs-00001-00100" / "00001"
+    run_dir.mkdir(parents=True)
+    (run_dir / "run.log").write_text("log")
+    (run_dir / "output.sas").write_text("task")
+    exp = types.SimpleNamespace(path=str(exp_path), name="exp")
+    step = CompressStep(exp, str(tmp_path), compression=compression, excludes=["*.sas"])
+    for use_compressor in [True, False]:
+        if not use_compressor:
+            monkeypatch.setattr(step, "_get_compressor", lambda: None)
+        step()
+        with tarfile.open(tmp_path / f"exp.tar.{compression}") as tar:
+            names = tar.getnames()
+        assert "exp/runs-00001-00100/00001/run.log" in names
+        assert "exp/runs-00001-00100/00001/output.sas" not in names
+
+
+def test_executor_stops_on_sigterm(tmp_path):
+    exp_path = tmp_path / "exp"
+    exp_path.mkdir()
+    writer = executor.RunSpecsWriter(exp_path)
+    for run_id in range(1, 4):
+        writer.add(
+            executor.get_run_spec(
+                f"runs-00001-00100/{run_id:05d}",
+                [(["sleep", "10"], {"name": "sleep", "time_limit": 20})],
+            )
+        )
+    writer.close()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "lab.calls.executor", str(exp_path), "1", "2", "3"]
+        + ["--scratch", str(tmp_path / "scratch")],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    journal = executor.RunJournal(exp_path)
+    for _ in range(100):
+        if journal.get_states():
+            break
+        time.sleep(0.1)
+    # Wait until the run executes its command.
+    time.sleep(0.5)
+    proc.send_signal(signal.SIGTERM)
+    assert proc.wait(timeout=10) != 0
+    states = journal.get_states()
+    assert list(states) == [1]
+    assert states[1]["state"] == "started"
+    # The interrupted run is staged out and executed again on resubmission.
+    assert (exp_path / "runs-00001-00100" / "00001" / "driver.log").exists()
+    assert executor.reset_unfinished_runs(exp_path, 3) == [1, 2, 3]
+
+
+def test_parse_in_parts(tmp_path, monkeypatch):
+    exp = Experiment(path=str(tmp_path / "exp"))
+    for i in range(5):
+        run = exp.add_run()
+        run.add_command("echo", ["echo", f"value: {i}"])
+        run.set_property("id", [f"run{i}"])
+    parser = Parser()
+    parser.add_pattern("value", r"value: (\d+)", type=int, file="run.log")
+    exp.add_parser(parser)
+    exp.build()
+    for spec in executor.RunSpecs(exp.path):
+        executor.process_run(os.path.join(exp.path, spec["run_dir"]), spec)
+
+    for part in ["1/2", "2/2", "merge"]:
+        monkeypatch.setenv(PARSE_PART_VARIABLE, part)
+        exp.parse()
+    assert len(os.listdir(os.path.join(exp.path, "parse-parts"))) == 2
+    assert os.path.exists(os.path.join(exp.path, "properties"))
+    eval_dir = tmp_path / "exp-eval"
+    Fetcher()(exp.path, eval_dir=eval_dir)
+    props = json.loads((eval_dir / "properties").read_text())
+    assert {run_id: props[run_id]["value"] for run_id in props} == {
+        f"run{i}": i for i in range(5)
+    }
+
+
+def get_slurm_stages(tmp_path, **env_kwargs):
+    """Return the jobs for the Slurm steps as a list of {name: content} dicts."""
+    env = environments.BaselSlurmEnvironment(**env_kwargs)
+    exp = Experiment(path=str(tmp_path / "exp"), environment=env)
+    for run_id in range(1, 5):
+        run = exp.add_run()
+        run.add_command("sleep", ["sleep", "0"], time_limit=run_id * 100)
+        run.set_property("id", [f"run{run_id}"])
+        run.set_property("algorithm", "blind" if run_id % 2 else "lmcut")
+    exp.add_step("build", exp.build)
+    exp.add_step("start", exp.start_runs)
+    exp.add_step("parse", exp.parse)
+    exp.add_fetcher(name="fetch")
+    exp.build(write_to_disk=False)
+    return [dict(jobs) for jobs in env._get_stages(exp.steps)]
+
+
+def get_num_tasks(job):
+    return int(re.search(r"--array=1-(\d+)", job).group(1))
+
+
+def test_slurm_parallel_runs(tmp_path):
+    stages = get_slurm_stages(
+        tmp_path, parallel_runs=True, cpus_per_task=4, memory_per_cpu="3872M"
+    )
+    assert [list(jobs) for jobs in stages] == [
+        ["exp-01-build"],
+        ["exp-02-start"],
+        ["exp-03-parse"],
+        ["exp-04-fetch"],
+    ]
+    run_job = stages[1]["exp-02-start"]
+    # All four runs fit into a single task with four cores.
+    assert get_num_tasks(run_job) == 1
+    # 4 * 3872 MiB * 0.98
+    assert "--processes 4 --memory-budget 15178 " in run_job
+
+
+def test_slurm_tasks_by_duration(tmp_path):
+    stages = get_slurm_stages(tmp_path, task_duration=500)
+    run_job = stages[1]["exp-02-start"]
+    assert get_num_tasks(run_job) == 2
+    # The expected durations are the time limits: 100, 200, 300 and 400 seconds.
+    assert 'declare -a TASK_RUN_IDS=("1 4" "2 3")' in run_job
+    assert "$(shuf -e ${TASK_RUN_IDS[$TASK_ID - 1]})" in run_job
+
+
+def get_lmcut_settings(run_properties):
+    if run_properties["algorithm"] == "lmcut":
+        return {"partition": "infai_2", "memory_per_cpu": "6354M"}
+    return None
+
+
+def test_slurm_job_settings(tmp_path):
+    stages = get_slurm_stages(tmp_path, job_settings=get_lmcut_settings)
+    # The run jobs may run in parallel and the parse job waits for both.
+    assert list(stages[1]) == ["exp-02-start-1-infai_1", "exp-02-start-2-infai_2"]
+    assert list(stages[2]) == ["exp-03-parse"]
+    blind_job, lmcut_job = stages[1].values()
+    assert "#SBATCH --partition=infai_1" in blind_job
+    assert 'declare -a TASK_RUN_IDS=("1" "3")' in blind_job
+    assert "#SBATCH --partition=infai_2" in lmcut_job
+    assert "#SBATCH --mem-per-cpu=6354M" in lmcut_job
+    assert 'declare -a TASK_RUN_IDS=("2" "4")' in lmcut_job
+    assert get_num_tasks(lmcut_job) == 2
+
+
+def test_slurm_combine_steps(tmp_path):
+    stages = get_slurm_stages(tmp_path, combine_steps=True)
+    assert [list(jobs) for jobs in stages] == [
+        ["exp-01-build"],
+        ["exp-02-start"],
+        ["exp-03-parse-to-fetch"],
+    ]
+    combined_job = stages[2]["exp-03-parse-to-fetch"]
+    assert "#SBATCH --job-name=exp-03-parse-to-fetch" in combined_job
+    assert combined_job.rstrip().endswith('"parse" "fetch"')
+
+    # Distributed parse steps keep their own jobs.
+    stages = get_slurm_stages(tmp_path, combine_steps=True, parse_tasks=2)
+    assert [list(jobs) for jobs in stages][2:] == [
+        ["exp-03-parse"],
+        ["exp-03-parse-merge"],
+        ["exp-04-fetch"],
+    ]
+    assert "#SBATCH --job-name=exp-03-parse-merge" in stages[3]["exp-03-parse-merge"]
+
+
+def test_slurm_parse_tasks_remove_old_parts(tmp_path):
+    parts_dir = tmp_path / "exp" / "parse-parts"
+    parts_dir.mkdir(parents=True)
+    (parts_dir / "part-00001-of-00003.json").write_text("{}")
+    stages = get_slurm_stages(tmp_path, parse_tasks=2)
+    assert get_num_tasks(stages[2]["exp-03-parse"]) == 2
+    assert not parts_dir.exists()
@@ -1,7 +1,9 @@
 import lab
-from lab import reports
+from lab import monitor, reports
+from lab.calls import executor, scheduler
 from lab.calls.call import Call
 from lab.environments import TetralithEnvironment
+from lab.reports.filter import NormalizeTimes
 
 assert reports.Table.add_col
 assert reports.Table.get_row
@@ -10,5 +12,10 @@ assert lab.tools.deprecated
 assert lab.tools.get_lab_path
 
 assert Call
+assert executor.reset_run
+assert monitor.print_status
+assert scheduler.run_tasks
+assert scheduler.get_cpu_nodes
+assert NormalizeTimes
 
 TetralithEnvironment.is_present()